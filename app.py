@@ -1,9 +1,18 @@
-import os, threading, html, csv, io, secrets
+import os, threading, html, csv, io, secrets, tempfile, time, json, base64, queue, socket
+import bisect, random, sys, hashlib, re, gzip, mimetypes, zlib
+import http.client, urllib.parse
+from collections import namedtuple, deque, Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import click
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
 from functools import wraps
-from datetime import datetime, timedelta
-from flask import (Flask, render_template, request, redirect,
-                   session, jsonify, flash, send_file, url_for)
+from datetime import datetime, timedelta, date
+from flask import (Flask, render_template, request, redirect, Response, g,
+                   session, jsonify, flash, url_for, stream_with_context,
+                   send_from_directory)
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import FlaskForm, CSRFProtect
 from wtforms import (StringField, IntegerField, TelField, DateField,
@@ -14,6 +23,11 @@ from dotenv import load_dotenv
 from werkzeug.security import check_password_hash, generate_password_hash
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from sqlalchemy import text, func, event
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 
 load_dotenv()
@@ -21,7 +35,8 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", secrets.token_hex(32))
 
-app.config['SESSION_COOKIE_SECURE']   = True
+# SESSION_COOKIE_SECURE=0 بس للتشغيل المحلي على http (benchmarks)
+app.config['SESSION_COOKIE_SECURE']   = os.getenv('SESSION_COOKIE_SECURE', '1') == '1'
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Strict'
 # ✅ PostgreSQL في production، SQLite للـ development
@@ -36,10 +51,82 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_size':     10,         # max connections في نفس الوقت
     'max_overflow':  20,         # connections إضافية وقت الضغط
 }
+# threads الـ gthread worker — الـ Procfile بيقرأ نفس الـ env (--threads ${WEB_THREADS:-20})
+# السقف: WEB_THREADS + background threads (outbox/reminders/SSE) ≤ pool_size + max_overflow
+# (10+20 = 30) — غير كده الـ requests بتستنى connection لحد pool_timeout
+app.config['WEB_THREADS'] = int(os.getenv('WEB_THREADS', 20))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER']    = os.path.join(os.path.dirname(__file__), 'static')
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024   # 5MB max
 ALLOWED_EXT = {'png', 'jpg', 'jpeg', 'webp'}
+# الحالات اللي فورم الحجز العام بيقبلها — أي اسم تاني من الـ form بيتشال
+app.config['CONDITIONS']         = ('Diabetes', 'High Blood Pressure', 'Old Injury')
+# صورة الدكتور — بتتفك مرة واحدة عند الرفع وتتحفظ بمقاسات WebP/JPEG بأسماء فيها الـ hash
+app.config['PHOTO_DIR']          = os.path.join(os.path.dirname(__file__), 'static', 'photos')
+app.config['PHOTO_WIDTHS']       = (120, 240, 480)       # الـ avatar 100px — لحد شاشات 4x
+app.config['PHOTO_QUALITY']      = {'webp': 80, 'jpeg': 82}
+app.config['PHOTO_MAX_PIXELS']   = 40_000_000            # أكبر من كده مرفوضة (decompression bomb)
+# ملفات الـ stamps — قناة محلية بين الـ gunicorn workers على نفس السيرفر
+app.config['STAMP_DIR'] = os.getenv('STAMP_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'clinic-stamps'))
+app.config['SETTINGS_RECHECK'] = 60   # ثواني — تحقق احتياطي من updated_at في الـ DB
+app.config['AVAIL_TTL']        = 60   # ثواني — أقصى عمر للـ bitmap قبل ما يتحمّل تاني
+app.config['AVAIL_MAX_DATES']  = 512
+app.config['AVAIL_RANGE_MAX_DAYS'] = 92   # أقصى فترة لـ /available_slots/range
+app.config['AVAIL_MAX_AGE']    = 5    # ثواني — Cache-Control على /available_slots (بعدها revalidate بالـ ETag)
+
+# Live slots (SSE) — كل stream مفتوح ماسك thread من الـ worker (من غير DB connection)
+# السعة = SSE_MAX_CLIENTS × workers صفحة مفتوحة (12 × 4 = 48) — الباقي بيكمّل بالـ fetch العادي
+# وبيفضل WEB_THREADS - SSE_MAX_CLIENTS thread للـ requests العادية حتى لو الـ streams مليانة
+app.config['SSE_MAX_CLIENTS']  = int(os.getenv('SSE_MAX_CLIENTS', app.config['WEB_THREADS'] - 8))
+app.config['SSE_POLL']         = 1.0    # ثواني — فحص stamps الـ workers التانية
+app.config['SSE_PING']         = 15     # ثواني — comment عشان الـ proxies ومعرفة الـ clients اللي قفلت
+app.config['SSE_MAX_AGE']      = 120    # ثواني — بعدها الـ stream يقفل والـ browser يعمل reconnect
+app.config['SSE_RETRY']        = 3000   # ms — retry للـ EventSource
+TAKEN_STATUSES = ('confirmed', 'attended')
+app.config['PAGE_SIZE']     = int(os.getenv('PAGE_SIZE', 50))   # صفوف /bookings و /patients
+app.config['PAGE_SIZE_MAX'] = 200
+# الـ outbox — إشعارات SMS/واتساب
+app.config['OUTBOX_WORKERS']      = 4                              # threads ثابتة لكل worker
+app.config['OUTBOX_CHANNEL_LIMIT'] = {'sms': 3, 'whatsapp': 1}     # أقصى إرسال متزامن لكل قناة
+app.config['OUTBOX_MAX_ATTEMPTS'] = 5
+app.config['OUTBOX_BACKOFF']      = 30                             # ثواني — بتتضاعف مع كل محاولة
+app.config['OUTBOX_POLL']         = 30                             # ثواني — poll احتياطي للـ retries
+app.config['OUTBOX_STALE']        = 300                            # 'sending' أقدم من كده يرجع pending
+# live = Twilio/CallMeBot، local = stand-in في الذاكرة للتجارب والـ benchmarks
+app.config['NOTIFY_TRANSPORT']     = os.getenv('NOTIFY_TRANSPORT', 'live')
+app.config['NOTIFY_LOCAL_LATENCY'] = float(os.getenv('NOTIFY_LOCAL_LATENCY', 0))   # ثواني لكل رسالة
+app.config['NOTIFY_TIMEOUT']       = 10
+# التذكيرات — scheduler واحد (leader) لكل الـ workers
+app.config['REMINDER_LEAD']      = timedelta(hours=24)   # التذكير قبل الموعد بكام
+app.config['REMINDER_BATCH']     = 200
+app.config['REMINDER_MAX_SLEEP'] = 300                   # ثواني — أقصى نوم بين كل فحص
+app.config['LEADER_LEASE']       = 90                    # ثواني — عمر الـ lease في SQLite
+# عدّ الـ SQL لكل request — warning لو عدّى الحد
+app.config['SQL_WARN_QUERIES']   = int(os.getenv('SQL_WARN_QUERIES', 25))
+app.config['SQL_WARN_TIME']      = float(os.getenv('SQL_WARN_TIME', 0.25))   # ثواني
+app.config['SQL_N_PLUS_ONE']     = 5                     # نفس الـ statement بيتكرر كام مرة = N+1
+app.config['SQL_SERVER_TIMING']  = os.getenv('SQL_SERVER_TIMING', '0') == '1'   # header للـ benchmarks
+# /metrics — الأدمن أو Prometheus بـ Authorization: Bearer $METRICS_TOKEN
+app.config['METRICS_TOKEN']      = os.getenv('METRICS_TOKEN', '')
+app.config['METRICS_FLUSH']      = 5                     # ثواني — كل worker بيكتب أرقامه كل قد ايه
+app.config['METRICS_RETAIN']     = 24 * 3600             # ملفات الـ workers الميتة بتتمسح بعدها
+# profiler — الأدمن بـ ?_profile=1 أو header X-Profile، أو نسبة من الزيارات (0.01 = 1%)
+app.config['PROFILE_SAMPLE']     = float(os.getenv('PROFILE_SAMPLE', 0))
+app.config['PROFILE_DIR']        = os.getenv('PROFILE_DIR', '')   # فاضي = STAMP_DIR/profiles
+app.config['PROFILE_KEEP']       = 50
+# static assets — build بـ `flask assets` (أو تلقائي عند التشغيل لو الملفات اتغيرت)
+app.config['ASSETS_DIST']        = os.path.join(os.path.dirname(__file__), 'static', 'dist')
+app.config['ASSETS_AUTO_BUILD']  = os.getenv('ASSETS_AUTO_BUILD', '1') == '1'
+app.config['ASSETS_MAX_AGE']     = 365 * 24 * 3600       # الاسم فيه الـ hash — مفيش داعي يتعمل revalidate
+app.config['ASSETS_GRACE']       = 24 * 3600             # النسخ القديمة تفضل يوم لصفحات مفتوحة
+# ضغط الـ responses (gzip / brotli) — الـ JSON الصغير زي /available_slots بيعدّي من غير ضغط
+app.config['COMPRESS_ENABLED']   = os.getenv('COMPRESS_ENABLED', '1') == '1'
+app.config['COMPRESS_MIN_SIZE']  = 1024                  # bytes — أقل من كده الـ headers أغلى من التوفير
+app.config['COMPRESS_TYPES']     = {'text/html', 'application/json', 'text/csv', 'text/css',
+                                    'text/plain', 'application/javascript', 'image/svg+xml'}
+app.config['COMPRESS_LEVEL']     = 6                     # gzip
+app.config['COMPRESS_BR_QUALITY'] = 4                    # brotli للـ responses الديناميكية (11 للـ static build)
 
 db     = SQLAlchemy(app)
 csrf = CSRFProtect(app)
@@ -47,6 +134,7 @@ csrf = CSRFProtect(app)
 # Rate Limiter — يستخدم الـ DB لو PostgreSQL متاح، وإلا RAM
 _redis_url = os.getenv('REDIS_URL')
 _limiter_storage = _redis_url if _redis_url else "memory://"
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', '1') == '1'   # 0 للـ load tests
 limiter = Limiter(
     get_remote_address,
     app=app,
@@ -87,28 +175,886 @@ def security_headers(response):
     return response
 
 
+# ─────────────────────────────────────────────
+#  COMPRESSION — WSGI middleware (gzip / brotli) يشتغل مع الـ streaming كمان
+# ─────────────────────────────────────────────
+try:
+    import brotli
+except ImportError:             # من غير brotli — gzip بس
+    brotli = None
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)   # 31 = gzip header
+
+    def compress(self, data):
+        return self._z.compress(data)
+
+    def flush(self):
+        return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._z.flush()
+
+
+class _Brotli:
+    def __init__(self, quality):
+        self._c = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._c.process(data)
+
+    def flush(self):
+        return self._c.flush()
+
+    def finish(self):
+        return self._c.finish()
+
+
+class CompressionMiddleware:
+    """بيضغط الـ response لو:
+    الـ client بيقبل br/gzip، والـ content type في COMPRESS_TYPES، ومفيش Content-Encoding أصلاً،
+    والحجم ≥ COMPRESS_MIN_SIZE — لو Content-Length مش معروف (generator) بنـ buffer لحد الحد ده بس
+    الـ responses اللي Content-Length بتاعها صغير بتعدّي زي ما هي من غير أي شغل"""
+    SKIP_STATUS = {'204', '206', '304'}
+
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app = wsgi_app
+        self.config   = config
+
+    def _encoding(self, environ):
+        accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli and accept['br']:
+            return 'br'
+        if accept['gzip']:
+            return 'gzip'
+        return None
+
+    def __call__(self, environ, start_response):
+        encoding = self.config['COMPRESS_ENABLED'] and environ['REQUEST_METHOD'] != 'HEAD' \
+            and self._encoding(environ)
+        if not encoding:
+            return self.wsgi_app(environ, start_response)
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured.update(status=status, headers=headers, exc_info=exc_info)
+            return lambda data: None   # محدش في الـ app بيستخدم write()
+
+        body = self.wsgi_app(environ, capture)
+        status, headers = captured['status'], captured['headers']
+        h = Headers(headers)
+        ctype = (h.get('Content-Type') or '').split(';')[0].strip()
+        length = h.get('Content-Length')
+        if (status[:3] in self.SKIP_STATUS or 'Content-Encoding' in h
+                or ctype not in self.config['COMPRESS_TYPES']
+                or 'no-transform' in h.get('Cache-Control', '')
+                or (length is not None and int(length) < self.config['COMPRESS_MIN_SIZE'])):
+            start_response(status, headers, captured['exc_info'])
+            return body
+        return self._compress(body, status, h, encoding, streamed=length is None,
+                              start_response=start_response, exc_info=captured['exc_info'])
+
+    def _compress(self, body, status, h, encoding, streamed, start_response, exc_info):
+        chunks = iter(body)
+        head, size = [], 0
+        try:
+            # buffer لحد COMPRESS_MIN_SIZE عشان نعرف نضغط ولا لأ
+            for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
+                if size >= self.config['COMPRESS_MIN_SIZE']:
+                    break
+            else:
+                # خلص قبل الحد — يطلع من غير ضغط
+                if hasattr(body, 'close'):
+                    body.close()
+                h['Content-Length'] = str(size)
+                start_response(status, h.to_wsgi_list(), exc_info)
+                return head
+        except BaseException:
+            if hasattr(body, 'close'):
+                body.close()
+            raise
+
+        comp = (_Brotli(self.config['COMPRESS_BR_QUALITY']) if encoding == 'br'
+                else _Gzip(self.config['COMPRESS_LEVEL']))
+        h.pop('Content-Length', None)
+        h['Content-Encoding'] = encoding
+        vary = h.get('Vary')
+        if not vary or 'accept-encoding' not in vary.lower():
+            h['Vary'] = f"{vary}, Accept-Encoding" if vary else 'Accept-Encoding'
+        etag = h.get('ETag')
+        if etag and not etag.startswith('W/'):
+            h['ETag'] = 'W/' + etag   # نفس المحتوى بس البايتات اتغيرت
+        start_response(status, h.to_wsgi_list(), exc_info)
+
+        def stream():
+            try:
+                out = comp.compress(b''.join(head))
+                for chunk in chunks:
+                    out += comp.compress(chunk)
+                    # الـ generators (CSV مثلاً) تطلع أول بأول بدل ما تستنى الآخر
+                    if streamed:
+                        yield out + comp.flush()
+                        out = b''
+                yield out + comp.finish()
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+        return stream()
+
+
+app.wsgi_app = CompressionMiddleware(app.wsgi_app, app.config)
+
+
+# ─────────────────────────────────────────────
+#  QUERY STATS — عدد ووقت الـ SQL لكل request + كشف N+1
+# ─────────────────────────────────────────────
+_sql_local = threading.local()
+
+
+class QueryLog:
+    """الـ statements اللي اتنفذت جوه request أو block — مع الوقت الكلي"""
+    def __init__(self):
+        self.count      = 0
+        self.time       = 0.0
+        self.statements = Counter()
+
+    def repeated(self):
+        """statements اتكررت SQL_N_PLUS_ONE مرة أو أكتر — غالباً lazy load جوه loop"""
+        return [(sql, n) for sql, n in self.statements.most_common()
+                if n >= app.config['SQL_N_PLUS_ONE']]
+
+
+def _collectors():
+    stack = getattr(_sql_local, 'stack', None)
+    if stack is None:
+        stack = _sql_local.stack = []
+    return stack
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _sql_start(conn, cursor, statement, parameters, context, executemany):
+    context._sql_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _sql_end(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._sql_start
+    for log in _collectors():
+        log.count += 1
+        log.time  += elapsed
+        log.statements[statement] += 1
+
+
+@contextmanager
+def query_log():
+    """سجّل كل الـ SQL اللي بيتنفذ جوه الـ block على الـ thread ده"""
+    log = QueryLog()
+    _collectors().append(log)
+    try:
+        yield log
+    finally:
+        _collectors().remove(log)
+
+
+@contextmanager
+def assert_max_queries(n):
+    """للتجارب: with assert_max_queries(5): client.get('/dashboard')"""
+    with query_log() as log:
+        yield log
+    if log.count > n:
+        top = '\n'.join(f"  {k}× {' '.join(sql.split())[:200]}"
+                        for sql, k in log.statements.most_common(5))
+        raise AssertionError(f"{log.count} queries > budget {n}:\n{top}")
+
+
+@app.before_request
+def start_query_log():
+    g.sql = QueryLog()
+    _collectors().append(g.sql)
+
+
+@app.after_request
+def report_query_log(response):
+    log = g.pop('sql', None)
+    if log is None:
+        return response
+    if log in _collectors():
+        _collectors().remove(log)
+    if app.config['SQL_SERVER_TIMING']:
+        response.headers['Server-Timing'] = f'db;dur={log.time * 1000:.1f};desc="{log.count} queries"'
+    if log.count > app.config['SQL_WARN_QUERIES'] or log.time > app.config['SQL_WARN_TIME']:
+        app.logger.warning(f"{request.method} {request.path}: {log.count} queries, "
+                           f"{log.time * 1000:.0f}ms in DB")
+    for sql, k in log.repeated():
+        app.logger.warning(f"Possible N+1 on {request.path}: {k}× {' '.join(sql.split())[:200]}")
+    return response
+
+
+@app.teardown_request
+def drop_query_log(exc):
+    # لو الـ request وقع قبل after_request
+    log = g.pop('sql', None)
+    if log is not None and log in _collectors():
+        _collectors().remove(log)
+
+
+# ميزانية الـ queries لصفحات الأدمن — ثابتة مهما كبرت الـ DB ({pid} = أول مريض)
+QUERY_BUDGETS = {
+    '/dashboard':              8,
+    '/bookings':               4,
+    '/bookings?view=calendar': 4,
+    '/bookings?search=010':    4,
+    '/patients':               4,
+    '/patients?search=010':    4,
+    '/patient/{pid}':          4,
+    '/ratings':                3,
+    '/settings':               3,
+    '/upload_photo':           2,
+    '/change_password':        2,
+    '/metrics':                2,
+    '/profiles':               0,
+}
+
+
+@app.cli.command('query-budget')
+def query_budget_command():
+    """flask --app app query-budget — افتح كل صفحة أدمن واتأكد إنها جوه ميزانية الـ queries"""
+    app.config['SESSION_COOKIE_SECURE'] = False   # test client على http
+    app.config['RATELIMIT_ENABLED']     = False
+    limiter.enabled = False
+    c = app.test_client()
+    with c.session_transaction() as s:
+        s['admin_logged_in'] = True
+    first  = db.session.query(PatientProfile.id).order_by(PatientProfile.id).first()
+    failed = 0
+    for path, budget in QUERY_BUDGETS.items():
+        if '{pid}' in path and not first:
+            continue
+        url = path.format(pid=first[0] if first else 0)
+        try:
+            with assert_max_queries(budget) as log:
+                status = c.get(url).status_code
+        except AssertionError as e:
+            failed += 1
+            click.echo(f"FAIL {url}\n{e}")
+            continue
+        click.echo(f"ok   {url:<26} {log.count:>3}/{budget} queries  {log.time * 1000:6.1f}ms  [{status}]")
+    if failed:
+        raise click.ClickException(f"{failed} page(s) over budget")
+
+
+# ─────────────────────────────────────────────
+#  METRICS — Prometheus text format، مجمّعة من كل الـ workers
+# ─────────────────────────────────────────────
+# كل worker بيكتب أرقامه في STAMP_DIR/metrics/<pid>-<start>.json كل METRICS_FLUSH ثانية،
+# و /metrics بيجمع كل الملفات: الـ counters والـ histograms من كل الملفات (حتى الـ workers
+# اللي ماتت)، والـ gauges من الـ workers الشغالة بس.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    'http_requests_total':                 ('counter',   'HTTP requests by endpoint, method and status'),
+    'http_request_duration_seconds':       ('histogram', 'Time to build the response, by endpoint'),
+    'db_pool_checkout_wait_seconds':       ('histogram', 'Time spent waiting for a pooled DB connection'),
+    'db_pool_timeouts_total':              ('counter',   'Pool checkouts that timed out'),
+    'db_pool_checked_out':                 ('gauge',     'DB connections in use (sum over live workers)'),
+    'db_pool_overflow':                    ('gauge',     'Connections opened beyond pool_size'),
+    'db_pool_size':                        ('gauge',     'Configured pool_size (sum over live workers)'),
+    'sse_clients':                         ('gauge',     'Open /available_slots/stream connections'),
+    'notifications_sent_total':            ('counter',   'Notification sends by channel and result'),
+    'notification_send_seconds':           ('histogram', 'Transport latency per notification'),
+    'notification_queue_delay_seconds':    ('histogram', 'Time from enqueue to delivery'),
+    'notifications_queued':                ('gauge',     'Outbox rows by status'),
+    'notification_oldest_pending_seconds': ('gauge',     'Age of the oldest pending notification'),
+    'cache_requests_total':                ('counter',   'In-process cache lookups by cache and result'),
+    'metrics_workers':                     ('gauge',     'Workers that reported in the last flush window'),
+}
+
+
+class Metrics:
+    """counters و histograms في الذاكرة — labels مترتبة عشان تبقى key ثابت"""
+    def __init__(self):
+        self.lock     = threading.Lock()
+        self.counters = {}   # (name, labels) → value
+        self.hists    = {}   # (name, labels) → [count لكل bucket..., +Inf, sum]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.hists.get(key)
+            if h is None:
+                h = self.hists[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            h[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            h[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {'counters': [[n, dict(l), v] for (n, l), v in self.counters.items()],
+                    'hists':    [[n, dict(l), list(h)] for (n, l), h in self.hists.items()],
+                    'gauges':   [[n, dict(l), v] for n, l, v in worker_gauges()]}
+
+
+metrics       = Metrics()
+_metrics_start = int(time.time())
+_pool_engines = []
+
+
+def _metrics_dir():
+    return os.path.join(app.config['STAMP_DIR'], 'metrics')
+
+
+def flush_metrics():
+    """اكتب snapshot الـ worker ده — atomic rename عشان /metrics ما يقراش ملف نصه مكتوب"""
+    os.makedirs(_metrics_dir(), exist_ok=True)
+    path = os.path.join(_metrics_dir(), f"{os.getpid()}-{_metrics_start}.json")
+    tmp  = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(metrics.snapshot(), f)
+    os.replace(tmp, path)
+
+
+def metrics_flusher():
+    while True:
+        time.sleep(app.config['METRICS_FLUSH'])
+        try:
+            flush_metrics()
+        except Exception as e:
+            app.logger.error(f"Metrics flush error: {e}")
+
+
+def instrument_pool(engine):
+    """قيس وقت انتظار connection من الـ pool — بنلف pool.connect() اللي الـ engine بيناديها"""
+    pool, connect = engine.pool, engine.pool.connect
+
+    def timed_connect():
+        t0 = time.perf_counter()
+        try:
+            return connect()
+        except Exception as e:
+            if type(e).__name__ == 'TimeoutError':
+                metrics.inc('db_pool_timeouts_total')
+            raise
+        finally:
+            metrics.observe('db_pool_checkout_wait_seconds', time.perf_counter() - t0)
+
+    pool.connect = timed_connect
+    _pool_engines.append(engine)
+
+
+def worker_gauges():
+    """gauges لحظية من الـ worker ده — حالة الـ pool"""
+    out = []
+    for engine in _pool_engines:
+        pool = engine.pool
+        for name, attr in (('db_pool_checked_out', 'checkedout'), ('db_pool_overflow', 'overflow'),
+                           ('db_pool_size', 'size')):
+            if hasattr(pool, attr):
+                out.append((name, (), max(getattr(pool, attr)(), 0)))
+    out.append(('sse_clients', (), slot_broadcaster.clients()))
+    return out
+
+
+def _merge_metrics():
+    """اجمع ملفات كل الـ workers — بيرجع (counters, hists, gauges, live workers)"""
+    counters, hists, gauges, live = {}, {}, {}, 0
+    fresh  = time.time() - 3 * app.config['METRICS_FLUSH']
+    retain = time.time() - app.config['METRICS_RETAIN']
+    for name in os.listdir(_metrics_dir()):
+        path = os.path.join(_metrics_dir(), name)
+        if not name.endswith('.json'):
+            continue
+        try:
+            mtime = os.path.getmtime(path)
+            if mtime < retain:
+                os.remove(path)   # worker مات من زمان
+                continue
+            with open(path) as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for n, l, v in snap['counters']:
+            key = (n, tuple(sorted(l.items())))
+            counters[key] = counters.get(key, 0) + v
+        for n, l, h in snap['hists']:
+            key = (n, tuple(sorted(l.items())))
+            hists[key] = [a + b for a, b in zip(hists.get(key, [0] * len(h)), h)]
+        if mtime >= fresh:
+            live += 1
+            for n, l, v in snap['gauges']:
+                key = (n, tuple(sorted(l.items())))
+                gauges[key] = gauges.get(key, 0) + v
+    return counters, hists, gauges, live
+
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in items) + '}'
+
+
+def render_metrics(counters, hists, gauges):
+    """Prometheus text exposition format 0.0.4"""
+    by_name = {}
+    for (n, l), v in counters.items():
+        by_name.setdefault(n, []).append((l, v))
+    for (n, l), v in gauges.items():
+        by_name.setdefault(n, []).append((l, v))
+    for (n, l), h in hists.items():
+        by_name.setdefault(n, []).append((l, h))
+    lines = []
+    for n in sorted(by_name):
+        kind, help_ = METRIC_HELP.get(n, ('untyped', n))
+        lines += [f"# HELP {n} {help_}", f"# TYPE {n} {kind}"]
+        for l, v in sorted(by_name[n], key=lambda x: x[0]):
+            if kind != 'histogram':
+                lines.append(f"{n}{_fmt_labels(l)} {v}")
+                continue
+            cum = 0
+            for le, c in zip(LATENCY_BUCKETS + ('+Inf',), v[:-1]):
+                cum += c
+                lines.append(f"{n}_bucket{_fmt_labels(l, [('le', le)])} {cum}")
+            lines.append(f"{n}_sum{_fmt_labels(l)} {v[-1]:.6f}")
+            lines.append(f"{n}_count{_fmt_labels(l)} {cum}")
+    return '\n'.join(lines) + '\n'
+
+
+@app.before_request
+def start_request_timer():
+    g.t0 = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    t0 = g.pop('t0', None)
+    if t0 is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - t0, endpoint=endpoint)
+        metrics.inc('http_requests_total', endpoint=endpoint, method=request.method,
+                    status=response.status_code)
+    return response
+
+
+# ─────────────────────────────────────────────
+#  PROFILER — لكل request عند الطلب، بصيغة collapsed stacks (flamegraph)
+# ─────────────────────────────────────────────
+class StackProfiler:
+    """sys.setprofile على thread الـ request بس — self time لكل stack بالـ microseconds"""
+    def __init__(self):
+        self.stacks = Counter()
+        self.path   = []
+
+    def start(self):
+        # نبدأ بالـ stack الحالي عشان الـ returns اللي جاية تتشال صح
+        frame = sys._getframe(1)
+        while frame is not None:
+            self.path.append(self._name(frame.f_code))
+            frame = frame.f_back
+        self.path.reverse()
+        self.t0 = self.last = time.perf_counter()
+        sys.setprofile(self._hook)
+
+    def stop(self):
+        sys.setprofile(None)
+        self.elapsed = time.perf_counter() - self.t0
+
+    @staticmethod
+    def _name(code):
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _hook(self, frame, event, arg):
+        now = time.perf_counter()
+        if self.path:
+            self.stacks[tuple(self.path)] += now - self.last
+        if event == 'call':
+            self.path.append(self._name(frame.f_code))
+        elif event == 'c_call':
+            self.path.append(f"{getattr(arg, '__qualname__', repr(arg))} (builtin)")
+        elif self.path and event in ('return', 'c_return', 'c_exception'):
+            self.path.pop()
+        self.last = time.perf_counter()
+
+    def folded(self):
+        """سطر لكل stack: frames مفصولة بـ ; وبعدها الوقت بالـ µs"""
+        for stack, secs in self.stacks.most_common():
+            us = round(secs * 1_000_000)
+            if us:
+                yield f"{';'.join(stack)} {us}\n"
+
+
+def _profile_dir():
+    return app.config['PROFILE_DIR'] or os.path.join(app.config['STAMP_DIR'], 'profiles')
+
+
+@app.before_request
+def start_profiler():
+    # المسار العادي: شوية dict lookups بس — مفيش profiler ولا thread
+    flagged = '_profile' in request.args or 'X-Profile' in request.headers
+    rate    = app.config['PROFILE_SAMPLE']
+    if not flagged and not rate:
+        return
+    if flagged and not session.get('admin_logged_in'):
+        return
+    if not flagged and random.random() >= rate:
+        return
+    g.profiler = StackProfiler()
+    g.profiler.start()
+
+
+@app.teardown_request
+def save_profile(exc):
+    p = g.pop('profiler', None)
+    if p is None:
+        return
+    p.stop()
+    try:
+        os.makedirs(_profile_dir(), exist_ok=True)
+        name = (f"{datetime.now():%Y%m%d-%H%M%S-%f}_{request.method}_{p.elapsed * 1000:.0f}ms_"
+                f"{request.endpoint or 'unmatched'}.folded")
+        with open(os.path.join(_profile_dir(), name), 'w') as f:
+            f.writelines(p.folded())
+        # rotation — آخر PROFILE_KEEP بس
+        for old in sorted(os.listdir(_profile_dir()))[:-app.config['PROFILE_KEEP']]:
+            os.remove(os.path.join(_profile_dir(), old))
+    except OSError as e:
+        app.logger.error(f"Profile save error: {e}")
+
+
+def recent_profiles():
+    """الـ profiles المحفوظة (الأحدث الأول) مع أكتر الدوال وقتاً (self time)"""
+    if not os.path.isdir(_profile_dir()):
+        return []
+    out = []
+    for name in sorted(os.listdir(_profile_dir()), reverse=True):
+        try:
+            stamp, method, ms, endpoint = name[:-len('.folded')].split('_', 3)
+            leaf, total = Counter(), 0
+            with open(os.path.join(_profile_dir(), name)) as f:
+                for line in f:
+                    stack, _, n = line.rstrip('\n').rpartition(' ')
+                    leaf[stack.rsplit(';', 1)[-1]] += int(n)
+                    total += int(n)
+        except (ValueError, OSError):
+            continue
+        out.append({'name': name, 'endpoint': endpoint, 'method': method, 'ms': ms[:-2],
+                    'at': datetime.strptime(stamp, '%Y%m%d-%H%M%S-%f'), 'functions': len(leaf),
+                    'top': [(fn, round(n * 100 / total)) for fn, n in leaf.most_common(5)]})
+    return out
+
+
+# ─────────────────────────────────────────────
+#  STATIC ASSETS — minify + اسم بالـ hash + gzip/brotli جاهزين
+# ─────────────────────────────────────────────
+ASSET_EXTS    = {'.css', '.js', '.svg', '.png', '.jpg', '.jpeg', '.webp', '.ico'}
+COMPRESS_EXTS = {'.css', '.js', '.svg'}   # الصور مضغوطة أصلاً
+_assets       = {}                        # logical name → {'file', 'mtime', 'size'}
+
+
+def minify_css(src):
+    """شيل الـ comments والمسافات الزيادة — كفاية للـ CSS بتاعنا (مفيش strings فيها ; أو {)"""
+    src = re.sub(r'/\*.*?\*/', '', src, flags=re.S)
+    src = re.sub(r'\s+', ' ', src)
+    src = re.sub(r'\s*([{};,>])\s*', r'\1', src)
+    src = re.sub(r'([{;])\s*([-a-z]+)\s*:\s*', r'\1\2:', src)
+    return src.replace(';}', '}').strip()
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _asset_sources():
+    """ملفات static/ اللي بتتبني — من غير dist نفسه وصور الدكتور (أسماءها فيها الـ hash أصلاً)"""
+    root = app.static_folder
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d)
+                       not in (app.config['ASSETS_DIST'], app.config['PHOTO_DIR'])]
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower() in ASSET_EXTS:
+                path = os.path.join(dirpath, name)
+                yield os.path.relpath(path, root).replace(os.sep, '/'), path
+
+
+def build_assets(echo=None):
+    """ابني static/dist — بيرجع الـ manifest الجديد
+    أسماء الملفات deterministic (hash المحتوى) فلو أكتر من worker بنوا مع بعض مفيش مشكلة"""
+    dist = app.config['ASSETS_DIST']
+    os.makedirs(dist, exist_ok=True)
+    manifest = {}
+    for logical, path in _asset_sources():
+        st   = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        base, ext = os.path.splitext(logical)
+        ext = ext.lower()
+        if ext == '.css':
+            data = minify_css(data.decode('utf-8')).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        out    = f"{base}.{digest}{ext}"
+        target = os.path.join(dist, out)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _write_atomic(target, data)
+            if ext in COMPRESS_EXTS:
+                _write_atomic(target + '.gz', gzip.compress(data, 9, mtime=0))
+                if brotli:
+                    _write_atomic(target + '.br', brotli.compress(data, quality=11))
+            if echo:
+                echo(f"{logical} → {out} ({st.st_size} → {len(data)} bytes)")
+        manifest[logical] = {'file': out, 'mtime': st.st_mtime_ns, 'size': st.st_size}
+    _write_atomic(os.path.join(dist, 'manifest.json'), json.dumps(manifest, indent=1).encode())
+    _assets.clear()
+    _assets.update(manifest)
+    _prune_assets(manifest)
+    return manifest
+
+
+def _prune_assets(manifest):
+    """امسح النسخ اللي مش في الـ manifest وعدّى عليها ASSETS_GRACE"""
+    dist = app.config['ASSETS_DIST']
+    keep = {e['file'] for e in manifest.values()}
+    old  = time.time() - app.config['ASSETS_GRACE']
+    for dirpath, _, filenames in os.walk(dist):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            rel  = os.path.relpath(path, dist).replace(os.sep, '/')
+            base = re.sub(r'\.(gz|br)$', '', rel)
+            if name != 'manifest.json' and base not in keep and os.path.getmtime(path) < old:
+                os.remove(path)
+
+
+def load_assets():
+    """حمّل الـ manifest — ولو ASSETS_AUTO_BUILD وأي ملف اتغير من آخر build ابنيه تاني"""
+    try:
+        with open(os.path.join(app.config['ASSETS_DIST'], 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if app.config['ASSETS_AUTO_BUILD']:
+        current = {logical: os.stat(path) for logical, path in _asset_sources()}
+        stale   = set(current) != set(manifest) or any(
+            (st.st_mtime_ns, st.st_size) != (manifest[k]['mtime'], manifest[k]['size'])
+            for k, st in current.items())
+        if stale:
+            try:
+                return build_assets()
+            except OSError as e:
+                app.logger.error(f"Asset build failed: {e}")
+    _assets.clear()
+    _assets.update(manifest)
+    return manifest
+
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    """url_for('static', filename='style.css') → /static/dist/style.<hash>.css
+    لو الملف اتغير بعد الـ build (رفع صورة مثلاً) يرجع للـ URL العادي"""
+    if endpoint != 'static':
+        return
+    e = _assets.get(values.get('filename'))
+    if not e:
+        return
+    try:
+        st = os.stat(os.path.join(app.static_folder, values['filename']))
+    except OSError:
+        return
+    if (st.st_mtime_ns, st.st_size) == (e['mtime'], e['size']):
+        values['filename'] = 'dist/' + e['file']
+
+
+@app.route('/static/dist/<path:name>')
+@limiter.exempt
+def static_asset(name):
+    """الملفات الـ fingerprinted — immutable، ونبعت .br/.gz الجاهز لو الـ browser بيقبله"""
+    dist     = app.config['ASSETS_DIST']
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    encoding = None
+    for enc, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[enc] and os.path.isfile(os.path.join(dist, name + suffix)):
+            encoding = enc
+            name    += suffix
+            break
+    resp = send_from_directory(dist, name, mimetype=mimetype, max_age=app.config['ASSETS_MAX_AGE'])
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    resp.headers['Vary']          = 'Accept-Encoding'
+    resp.headers['Cache-Control'] = f"public, max-age={app.config['ASSETS_MAX_AGE']}, immutable"
+    return resp
+
+
+@app.cli.command('assets')
+def assets_command():
+    """flask --app app assets — ابني static/dist (minify + hash + gzip/brotli)"""
+    manifest = build_assets(echo=click.echo)
+    click.echo(f"✅ {len(manifest)} assets{'' if brotli else ' (بدون brotli — pip install brotli)'}")
+
+
+# ─────────────────────────────────────────────
+#  DOCTOR PHOTO — variants بمقاسات مختلفة + srcset
+# ─────────────────────────────────────────────
+try:
+    from PIL import Image, ImageOps
+except ImportError:             # من غير Pillow — الرفع بيرجع رسالة خطأ
+    Image = ImageOps = None
+
+PHOTO_FORMATS = (('webp', 'image/webp'), ('jpeg', 'image/jpeg'))
+
+
+def _photo_name(version, width, fmt):
+    return f"doctor-{version}-{width}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def process_photo(data):
+    """فك الصورة مرة واحدة واكتب WebP + JPEG لكل عرض في PHOTO_WIDTHS — من غير EXIF/metadata
+    بترجع الـ version (أول 12 حرف من sha256 الملف الأصلي)، وبترمي ValueError لو الصورة مش سليمة"""
+    version = hashlib.sha256(data).hexdigest()[:12]
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.width * img.height > app.config['PHOTO_MAX_PIXELS']:
+            raise ValueError('أبعاد الصورة كبيرة جداً')
+        img = ImageOps.exif_transpose(img)   # الاتجاه من الـ EXIF قبل ما نشيله
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError('ملف الصورة غير صالح') from e
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+    # JPEG مفيهوش شفافية — خلفية بيضا
+    flat = img
+    if img.mode == 'RGBA':
+        flat = Image.new('RGB', img.size, 'white')
+        flat.paste(img, mask=img.getchannel('A'))
+
+    os.makedirs(app.config['PHOTO_DIR'], exist_ok=True)
+    for width in app.config['PHOTO_WIDTHS']:
+        size = (min(width, img.width), max(1, round(img.height * min(width, img.width) / img.width)))
+        for fmt, _ in PHOTO_FORMATS:
+            src = img if fmt == 'webp' else flat
+            out = io.BytesIO()
+            src.resize(size, Image.LANCZOS).save(
+                out, fmt.upper(), quality=app.config['PHOTO_QUALITY'][fmt], optimize=True)
+            _write_atomic(os.path.join(app.config['PHOTO_DIR'], _photo_name(version, width, fmt)),
+                          out.getvalue())
+    return version
+
+
+def set_doctor_photo(data):
+    """اعمل الـ variants وسجّل النسخة في الإعدادات — والنسخ الأقدم من اللي قبلها تتمسح"""
+    version  = process_photo(data)
+    s        = get_settings()
+    previous = s.photo_version
+    s.photo_version = version
+    db.session.commit()
+    invalidate_settings()
+    # النسخة اللي قبلها تفضل لحد الرفع الجاي — صفحات مفتوحة أو workers لسه ما شافوش الـ stamp
+    keep = {version, previous}
+    for name in os.listdir(app.config['PHOTO_DIR']):
+        if name.startswith('doctor-') and name.split('-')[1] not in keep:
+            os.remove(os.path.join(app.config['PHOTO_DIR'], name))
+    return version
+
+
+def doctor_photo():
+    """src + srcset لكل format من الـ settings cache — من غير أي stat على الملفات
+    None لو مفيش صورة متعالجة (القالب بيرجع للـ static القديم)"""
+    version = cached_settings().photo_version
+    if not version:
+        return None
+    widths = app.config['PHOTO_WIDTHS']
+    srcset = {fmt: ', '.join(f"{url_for('photo_file', name=_photo_name(version, w, fmt))} {w}w"
+                             for w in widths)
+              for fmt, _ in PHOTO_FORMATS}
+    return {'webp': srcset['webp'], 'jpeg': srcset['jpeg'],
+            'src':  url_for('photo_file', name=_photo_name(version, widths[len(widths) // 2], 'jpeg'))}
+
+
+@app.route('/static/photos/<name>')
+@limiter.exempt
+def photo_file(name):
+    """الاسم فيه الـ hash — immutable"""
+    resp = send_from_directory(app.config['PHOTO_DIR'], name, max_age=app.config['ASSETS_MAX_AGE'])
+    resp.headers['Cache-Control'] = f"public, max-age={app.config['ASSETS_MAX_AGE']}, immutable"
+    return resp
+
+
 # ─────────────────────────────────────────────
 #  MODELS
 # ─────────────────────────────────────────────
+class Condition(db.Model):
+    """الحالات المزمنة (Diabetes / High Blood Pressure / ...) — lookup table"""
+    id   = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+
+
+# ربط الحجوزات والمرضى بالحالات — الـ index على condition_id للفلترة والـ GROUP BY
+booking_conditions = db.Table('booking_condition',
+    db.Column('booking_id',   db.Integer, db.ForeignKey('booking.id'),   primary_key=True),
+    db.Column('condition_id', db.Integer, db.ForeignKey('condition.id'), primary_key=True),
+    db.Index('ix_booking_condition_cond', 'condition_id', 'booking_id'))
+
+patient_conditions = db.Table('patient_condition',
+    db.Column('patient_id',   db.Integer, db.ForeignKey('patient_profile.id'), primary_key=True),
+    db.Column('condition_id', db.Integer, db.ForeignKey('condition.id'),       primary_key=True),
+    db.Index('ix_patient_condition_cond', 'condition_id', 'patient_id'))
+
+
 class Booking(db.Model):
     id          = db.Column(db.Integer, primary_key=True)
     name        = db.Column(db.String(100), nullable=False)
     age         = db.Column(db.Integer,     nullable=False)
     phone       = db.Column(db.String(20),  nullable=False)
+    phone_rev   = db.Column(db.String(20),  index=True)            # الرقم معكوس — للبحث بآخر الأرقام
     pain        = db.Column(db.String(300), nullable=False)
-    conditions  = db.Column(db.String(300))
-    date        = db.Column(db.String(20),  nullable=False)
-    appointment = db.Column(db.String(20),  nullable=False)
+    conditions  = db.Column(db.String(300))   # نص للعرض بس — الفلترة من condition_list
+    date        = db.Column(db.Date,        nullable=False)
+    slot        = db.Column(db.Integer,     nullable=False)        # دقائق من منتصف الليل — 900 = 3:00 PM
     status      = db.Column(db.String(20),  default='confirmed')   # confirmed/cancelled/attended
     cancel_token= db.Column(db.String(64),  unique=True)           # توكن الإلغاء
     created_at  = db.Column(db.DateTime,    default=datetime.utcnow)
     reminder_sent = db.Column(db.Boolean,   default=False)
 
-    __table_args__ = {}  # UniqueConstraint شيلناه — الـ check بيتم في الكود
+    # (date, status, reminder_sent) بيخدم كمان فلاتر (date, status) لأنها prefix منه
+    # uq_booking_active_slot: partial unique — حجز واحد شغال لكل ميعاد، الملغي مش بيحجز المكان
+    __table_args__ = (
+        db.Index('uq_booking_active_slot',        'date', 'slot', unique=True,
+                 sqlite_where=status.in_(TAKEN_STATUSES),
+                 postgresql_where=status.in_(TAKEN_STATUSES)),
+        db.Index('ix_booking_date_slot',          'date', 'slot'),
+        db.Index('ix_booking_date_status_remind', 'date', 'status', 'reminder_sent'),
+        db.Index('ix_booking_phone_date',         'phone', 'date'),
+        db.Index('ix_booking_status_created',     'status', 'created_at'),
+        db.Index('ix_booking_name_id',            'name', 'id'),   # /bookings?sort_by=name
+    )
     # العلاقة بملاحظات الجلسة
     session_notes = db.relationship('SessionNote', backref='booking', lazy=True)
     # العلاقة بالتقييم
     rating = db.relationship('BookingRating', backref='booking', uselist=False)
+    condition_list = db.relationship('Condition', secondary=booking_conditions, lazy=True)
+
+    @db.validates('phone')
+    def _set_phone_rev(self, key, value):
+        self.phone_rev = value[::-1] if value else None
+        return value
+
+    # الميعاد كنص ('3:00 PM') — بيتحسب من slot وقت العرض بس
+    @property
+    def appointment(self):
+        return minutes_to_slot(self.slot)
+
+    @appointment.setter
+    def appointment(self, value):
+        self.slot = slot_to_minutes(value) if value else None
 
 
 class PatientProfile(db.Model):
@@ -116,10 +1062,11 @@ class PatientProfile(db.Model):
     id           = db.Column(db.Integer, primary_key=True)
     name         = db.Column(db.String(100), nullable=False)
     phone        = db.Column(db.String(20),  nullable=False, unique=True, index=True)
+    phone_rev    = db.Column(db.String(20),  index=True)
     age          = db.Column(db.Integer)
-    conditions   = db.Column(db.String(500))
+    conditions   = db.Column(db.String(500))   # نص للعرض بس — الفلترة من condition_list
     first_visit  = db.Column(db.String(20))
-    last_visit   = db.Column(db.String(20))
+    last_visit   = db.Column(db.String(20), nullable=False, default='')   # '' مش NULL — عشان الـ keyset
     total_visits = db.Column(db.Integer, default=0)
     doctor_notes = db.Column(db.Text)
     created_at   = db.Column(db.DateTime, default=datetime.utcnow)
@@ -127,6 +1074,16 @@ class PatientProfile(db.Model):
 
     session_notes = db.relationship('SessionNote', backref='patient',
                                     lazy=True, order_by='SessionNote.date.desc()')
+    condition_list = db.relationship('Condition', secondary=patient_conditions, lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_patient_last_visit_id', 'last_visit', 'id'),   # ترتيب /patients
+    )
+
+    @db.validates('phone')
+    def _set_phone_rev(self, key, value):
+        self.phone_rev = value[::-1] if value else None
+        return value
 
 
 class SessionNote(db.Model):
@@ -134,8 +1091,8 @@ class SessionNote(db.Model):
     id           = db.Column(db.Integer, primary_key=True)
     patient_id   = db.Column(db.Integer, db.ForeignKey('patient_profile.id'), nullable=False)
     booking_id   = db.Column(db.Integer, db.ForeignKey('booking.id'))
-    date         = db.Column(db.String(20), nullable=False)
-    appointment  = db.Column(db.String(20))
+    date         = db.Column(db.Date,    nullable=False)
+    slot         = db.Column(db.Integer)   # دقائق من منتصف الليل
     complaint    = db.Column(db.String(300))
     diagnosis    = db.Column(db.Text)
     treatment    = db.Column(db.Text)
@@ -143,6 +1100,16 @@ class SessionNote(db.Model):
     next_session = db.Column(db.String(300))
     created_at   = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @property
+    def appointment(self):
+        return minutes_to_slot(self.slot)
+
+    @appointment.setter
+    def appointment(self, value):
+        # نص حر من الأدمن — لو مش بالشكل '4:00 PM' نسيبه فاضي
+        minutes   = slot_to_minutes(value) if value else None
+        self.slot = minutes if minutes != 9999 else None
+
 
 class BookingRating(db.Model):
     """تقييم المريض بعد الجلسة"""
@@ -152,6 +1119,12 @@ class BookingRating(db.Model):
     comment    = db.Column(db.String(500))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # صفحة /ratings: keyset على (created_at, id)، والتوزيع من الـ index من غير الجدول
+    __table_args__ = (
+        db.Index('ix_booking_rating_created', 'created_at', 'id'),
+        db.Index('ix_booking_rating_stars',   'stars'),
+    )
+
 
 class ClinicSettings(db.Model):
     """إعدادات العيادة — صف واحد دائماً"""
@@ -165,9 +1138,68 @@ class ClinicSettings(db.Model):
     work_days     = db.Column(db.String(20), default='0,1,2,3,5,6')  # بدون الجمعة
     # إجازات استثنائية (تواريخ مفصولة بفاصلة)
     holidays      = db.Column(db.Text, default='')
+    # نسخة صورة الدكتور الحالية (hash) — الملفات في PHOTO_DIR
+    photo_version = db.Column(db.String(20), default='')
     updated_at    = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class Notification(db.Model):
+    """outbox للإشعارات — بتتكتب في نفس transaction الحجز وبيبعتها الـ dispatcher"""
+    id              = db.Column(db.Integer, primary_key=True)
+    channel         = db.Column(db.String(20), nullable=False)            # sms/whatsapp
+    to              = db.Column(db.String(20), nullable=False)
+    body            = db.Column(db.Text,       nullable=False)
+    status          = db.Column(db.String(20), nullable=False, default='pending')  # pending/sending/sent/skipped/failed
+    attempts        = db.Column(db.Integer,    nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime,   default=datetime.utcnow)
+    claimed_at      = db.Column(db.DateTime)
+    sent_at         = db.Column(db.DateTime)
+    last_error      = db.Column(db.String(500))
+    created_at      = db.Column(db.DateTime,   default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_notification_due', 'status', 'next_attempt_at'),)
+
+
+class DailyStat(db.Model):
+    """rollup للـ dashboard — عدد الحجوزات لكل (يوم × حالة)"""
+    date   = db.Column(db.Date,       primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count  = db.Column(db.Integer,    nullable=False, default=0)
+
+
+class ConditionStat(db.Model):
+    """rollup — عدد الحجوزات لكل حالة مرضية"""
+    name  = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer,     nullable=False, default=0)
+
+
+class RatingStat(db.Model):
+    """rollup — مجموع وعدد التقييمات (صف واحد id=1)"""
+    id    = db.Column(db.Integer, primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PatientStat(db.Model):
+    """rollup — عدد ملفات المرضى (صف واحد id=1)"""
+    id    = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SchemaMigration(db.Model):
+    """سجل الـ migrations اللي اتنفذت على الـ DB"""
+    version    = db.Column(db.Integer, primary_key=True)
+    name       = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SchedulerLease(db.Model):
+    """مين الـ worker اللي ماسك الـ scheduler — بديل الـ advisory lock في SQLite"""
+    name       = db.Column(db.String(50),  primary_key=True)
+    holder     = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime,    nullable=False)
+
+
 class AdminCredentials(db.Model):
     """بيانات الأدمن — مخزّنة في DB عشان تتغير أوتوماتيك"""
     id            = db.Column(db.Integer, primary_key=True)
@@ -176,25 +1208,6 @@ class AdminCredentials(db.Model):
     updated_at    = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
-with app.app_context():
-    db.create_all()
-    # تصحيح الإعدادات القديمة لو start_hour < 8 (يعني مخزّن بالطريقة القديمة)
-    old_settings = ClinicSettings.query.first()
-    if old_settings and old_settings.start_hour < 8:
-        old_settings.start_hour = old_settings.start_hour + 12  # 3 → 15
-        if old_settings.end_hour < 12:
-            old_settings.end_hour = old_settings.end_hour + 12  # 11 → 23
-        db.session.commit()
-
-    # seed الأدمن من الـ env variables لو DB فاضي
-    if not AdminCredentials.query.first():
-        env_user = os.getenv("ADMIN_USERNAME", "admin")
-        env_hash = os.getenv("ADMIN_PASSWORD", "")
-        if env_hash:
-            db.session.add(AdminCredentials(username=env_user, password_hash=env_hash))
-            db.session.commit()
-
-
 # ─────────────────────────────────────────────
 #  HELPERS
 # ─────────────────────────────────────────────
@@ -206,6 +1219,15 @@ def get_admin():
     return os.getenv("ADMIN_USERNAME", "admin"), os.getenv("ADMIN_PASSWORD", "")
 
 
+def hour24_to_12(hour24):
+    """تحويل 24h لـ 12h format — مثال: 15 → '3:00 PM'"""
+    ampm = 'AM' if hour24 < 12 else 'PM'
+    h12  = hour24 % 12
+    if h12 == 0:
+        h12 = 12
+    return h12, ampm
+
+
 def get_settings():
     """جيب إعدادات العيادة — أنشئها لو مش موجودة"""
     s = ClinicSettings.query.first()
@@ -216,76 +1238,177 @@ def get_settings():
     return s
 
 
-def hour24_to_12(hour24):
-    """تحويل 24h لـ 12h format — مثال: 15 → '3:00 PM'"""
-    ampm = 'AM' if hour24 < 12 else 'PM'
-    h12  = hour24 % 12
-    if h12 == 0:
-        h12 = 12
-    return h12, ampm
+# ─────────────────────────────────────────────
+#  STAMPS — version counters مشتركة بين الـ workers
+# ─────────────────────────────────────────────
+def _stamp_path(name):
+    return os.path.join(app.config['STAMP_DIR'], name)
 
 
-def get_all_slots():
+def read_stamp(name):
+    """رقم الـ version الحالي (mtime بالـ ns) — stat واحد بدون DB"""
+    try:
+        return os.stat(_stamp_path(name)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def bump_stamp(name):
+    """زوّد الـ version — كل الـ workers هيشوفوا التغيير في أول read_stamp
+    بترجع (القديم, الجديد) — أو (None, None) لو فشلت"""
+    path = _stamp_path(name)
+    try:
+        os.makedirs(app.config['STAMP_DIR'], exist_ok=True)
+        old = read_stamp(name)
+        with open(path, 'a'):
+            pass
+        t = max(time.time_ns(), old + 1)
+        os.utime(path, ns=(t, t))
+        return old, t
+    except OSError as e:
+        app.logger.error(f"Stamp error ({name}): {e}")
+        return None, None
+
+
+# ─────────────────────────────────────────────
+#  SETTINGS CACHE
+# ─────────────────────────────────────────────
+SettingsSnapshot = namedtuple('SettingsSnapshot', [
+    'start_hour', 'start_minute', 'end_hour', 'slot_duration',
+    'work_days', 'holidays', 'slots', 'slot_minutes', 'slot_index', 'minute_index',
+    'photo_version', 'updated_at'])
+
+_settings_lock  = threading.Lock()
+_settings_cache = {'snap': None, 'stamp': None, 'checked': 0.0}
+
+
+def _build_slots(start_hour, start_minute, end_hour, slot_duration):
     """المواعيد المتاحة حسب الإعدادات — يستخدم 24h داخلياً"""
-    s      = get_settings()
     slots  = []
     # start_hour مخزّن كـ 24h (مثلاً 15 = 3 PM)
-    hour   = s.start_hour
-    minute = int(s.start_minute)
-    end_h  = s.end_hour
-
+    hour   = start_hour
+    minute = start_minute
     while True:
         h12, ampm = hour24_to_12(hour)
         slots.append(f"{h12}:{minute:02d} {ampm}")
-        minute += s.slot_duration
+        minute += slot_duration
         if minute >= 60:
             hour  += minute // 60
             minute = minute % 60
-        if hour > end_h or (hour == end_h and minute > 0):
+        if hour > end_hour or (hour == end_hour and minute > 0):
             break
-    return slots
+    return tuple(slots)
+
+
+def _load_settings_snapshot():
+    s = get_settings()
+    start_minute = int(s.start_minute or 0)
+    slots        = _build_slots(s.start_hour, start_minute, s.end_hour, s.slot_duration)
+    return SettingsSnapshot(
+        start_hour    = s.start_hour,
+        start_minute  = start_minute,
+        end_hour      = s.end_hour,
+        slot_duration = s.slot_duration,
+        work_days     = frozenset(int(d) for d in (s.work_days or '').split(',') if d.strip()),
+        holidays      = frozenset(d.strip() for d in (s.holidays or '').split(',') if d.strip()),
+        slots         = slots,
+        slot_minutes  = tuple(slot_to_minutes(x) for x in slots),
+        slot_index    = {x: i for i, x in enumerate(slots)},
+        minute_index  = {slot_to_minutes(x): i for i, x in enumerate(slots)},
+        photo_version = s.photo_version or '',
+        updated_at    = s.updated_at)
+
+
+def cached_settings():
+    """الإعدادات parsed من الـ cache — بدون query طالما الـ stamp ما اتغيرش"""
+    stamp = read_stamp('settings')
+    cache = _settings_cache
+    snap  = cache['snap']
+    now   = time.monotonic()
+    if snap is not None and cache['stamp'] == stamp:
+        if now - cache['checked'] < app.config['SETTINGS_RECHECK']:
+            metrics.inc('cache_requests_total', cache='settings', result='hit')
+            return snap
+        # تحقق احتياطي (لو في أكتر من سيرفر) — query خفيفة على updated_at بس
+        updated = db.session.query(ClinicSettings.updated_at).order_by(ClinicSettings.id).limit(1).scalar()
+        if updated == snap.updated_at:
+            cache['checked'] = now
+            metrics.inc('cache_requests_total', cache='settings', result='hit')
+            return snap
+    metrics.inc('cache_requests_total', cache='settings', result='miss')
+    with _settings_lock:
+        snap = _load_settings_snapshot()
+        cache.update(snap=snap, stamp=stamp, checked=now)
+    return snap
+
+
+def invalidate_settings():
+    """استدعيها بعد أي commit على ClinicSettings"""
+    _settings_cache['snap'] = None
+    bump_stamp('settings')
+
+
+def get_all_slots():
+    """المواعيد المتاحة حسب الإعدادات — من الـ cache"""
+    return list(cached_settings().slots)
 
 
 def get_work_days():
     """أيام العمل كـ set من الأرقام (0=الأحد)"""
-    s = get_settings()
-    return {int(d) for d in s.work_days.split(',') if d.strip()}
+    return cached_settings().work_days
 
 
 def get_holidays():
     """الإجازات الاستثنائية كـ set من التواريخ"""
-    s = get_settings()
-    return {d.strip() for d in s.holidays.split(',') if d.strip()}
+    return cached_settings().holidays
 
 
 def egypt_today():
     return datetime.now(CAIRO).date()
 
 
+def parse_date(date_str):
+    """'YYYY-MM-DD' → date — None لو فاضي أو غلط"""
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def closed_reason(d, snap=None):
+    """سبب غلق العيادة في اليوم d — None لو يوم عمل عادي"""
+    snap = snap or cached_settings()
+    # تحقق من أيام العمل (Python weekday: 0=Mon, 6=Sun)
+    # نحوّل لـ format الإعدادات (0=الأحد)
+    py_wd = d.weekday()  # 0=Mon..6=Sun
+    # Sun=6 in python → 0 in our system, Mon=0→1, ..., Sat=5→6
+    our_wd = (py_wd + 1) % 7
+    if our_wd not in snap.work_days:
+        return "العيادة مغلقة في هذا اليوم"
+    if d.strftime('%Y-%m-%d') in snap.holidays:
+        return "هذا اليوم إجازة استثنائية"
+    return None
+
+
 def valid_date(date_str):
     try:
         d = datetime.strptime(date_str, '%Y-%m-%d').date()
         if d < egypt_today():
             return False, "لا يمكن الحجز في تاريخ سابق"
-        # تحقق من أيام العمل (Python weekday: 0=Mon, 6=Sun)
-        # نحوّل لـ format الإعدادات (0=الأحد)
-        py_wd = d.weekday()  # 0=Mon..6=Sun
-        # Sun=6 in python → 0 in our system, Mon=0→1, ..., Sat=5→6
-        our_wd = (py_wd + 1) % 7
-        if our_wd not in get_work_days():
-            return False, "العيادة مغلقة في هذا اليوم"
-        if date_str in get_holidays():
-            return False, "هذا اليوم إجازة استثنائية"
+        reason = closed_reason(d)
+        if reason:
+            return False, reason
         return True, d
     except ValueError:
         return False, "تاريخ غير صالح"
 
 
-def booked_slots(date):
-    return [b.appointment for b in
-            Booking.query.filter(
-                Booking.date == date,
-                Booking.status.in_(['confirmed', 'attended'])
+def booked_slots(d):
+    """المواعيد المحجوزة في اليوم d — بالدقائق"""
+    return [slot for (slot,) in
+            db.session.query(Booking.slot).filter(
+                Booking.date == d,
+                Booking.status.in_(TAKEN_STATUSES)
             ).all()]
 
 
@@ -303,45 +1426,503 @@ def slot_to_minutes(slot_str):
         return 9999
 
 
-def filter_past_slots(slots, date_str):
-    """شيل المواعيد اللي فاتت لو التاريخ هو اليوم"""
-    today = egypt_today()
-    try:
-        selected = datetime.strptime(date_str, '%Y-%m-%d').date()
-    except:
-        return slots
+def minutes_to_slot(minutes):
+    """العكس — 900 → '3:00 PM'"""
+    if minutes is None:
+        return ''
+    h12, ampm = hour24_to_12(minutes // 60)
+    return f"{h12}:{minutes % 60:02d} {ampm}"
+
+
+def get_conditions(names):
+    """Condition objects للأسماء دي بنفس ترتيبها (من غير تكرار) — بيضيف الجديد منها
+    للمصادر الموثوقة بس (migrations / seed / حالات المريض الموجودة) — الـ form العام يعدّي على allowed_conditions الأول"""
+    names = list(dict.fromkeys(n.strip()[:100] for n in names if n and n.strip()))
+    if not names:
+        return []
+    found = {c.name: c for c in Condition.query.filter(Condition.name.in_(names))}
+    for name in [n for n in names if n not in found]:
+        try:
+            with db.session.begin_nested():
+                c = Condition(name=name)
+                db.session.add(c)
+            found[name] = c
+        except IntegrityError:
+            # worker تاني ضافها في نفس اللحظة
+            found[name] = Condition.query.filter_by(name=name).one()
+    return [found[n] for n in names]
+
+
+def allowed_conditions(names):
+    """الحالات من فورم عام — اللي في CONDITIONS بس، عشان محدش يكبّر جدول Condition من برّه"""
+    return [n for n in names if n in app.config['CONDITIONS']]
+
+
+def set_booking_conditions(b, names):
+    b.condition_list = get_conditions(names)
+    b.conditions     = ', '.join(c.name for c in b.condition_list)
 
-    if selected != today:
-        return slots  # لو مش اليوم — كل المواعيد متاحة
 
-    # احسب الوقت الحالي بتوقيت القاهرة بالدقائق
-    now_cairo   = datetime.now(CAIRO)
-    now_minutes = now_cairo.hour * 60 + now_cairo.minute + 30  # buffer 30 دقيقة
+# ─────────────────────────────────────────────
+#  AVAILABILITY — bitmap لكل يوم (bit لكل slot)
+# ─────────────────────────────────────────────
+_avail_lock  = threading.Lock()
+_avail_cache = {}   # date → {'stamp', 'slots', 'bits', 'loaded'}
+
+
+def _avail_stamp(d):
+    return f"avail-{d.strftime('%Y-%m-%d')}"
+
+
+def _past_cutoff(d):
+    """المواعيد لحد الدقيقة دي فاتت (الوقت الحالي + buffer 30 دقيقة) — -1 لو مش النهارده"""
+    if d != egypt_today():
+        return -1
+    now_cairo = datetime.now(CAIRO)
+    return now_cairo.hour * 60 + now_cairo.minute + 30
+
+
+def _taken_bits(d):
+    """(snapshot, bitmap) — الـ bitmap من الـ cache طالما الـ stamp ما اتغيرش"""
+    snap  = cached_settings()
+    stamp = read_stamp(_avail_stamp(d))
+    now   = time.monotonic()
+    e     = _avail_cache.get(d)
+    if (e and e['stamp'] == stamp and e['slots'] is snap.slots
+            and now - e['loaded'] < app.config['AVAIL_TTL']):
+        metrics.inc('cache_requests_total', cache='availability', result='hit')
+        return snap, e['bits']
+    metrics.inc('cache_requests_total', cache='availability', result='miss')
+
+    bits = 0
+    for minutes in booked_slots(d):
+        i = snap.minute_index.get(minutes)
+        if i is not None:
+            bits |= 1 << i
+    with _avail_lock:
+        if len(_avail_cache) >= app.config['AVAIL_MAX_DATES']:
+            today = egypt_today()
+            for old in [x for x in _avail_cache if x < today] or list(_avail_cache):
+                del _avail_cache[old]
+        _avail_cache[d] = {'stamp': stamp, 'slots': snap.slots,
+                           'bits': bits, 'loaded': now}
+    return snap, bits
+
+
+def _free_from_bits(snap, bits, cutoff):
+    return [s for i, s in enumerate(snap.slots)
+            if not (bits >> i) & 1 and snap.slot_minutes[i] > cutoff]
+
+
+def free_slots(d):
+    """المواعيد الفاضية في اليوم d (من غير اللي فاتت لو النهارده)"""
+    snap, bits = _taken_bits(d)
+    return _free_from_bits(snap, bits, _past_cutoff(d))
+
+
+def range_availability(start, end, with_slots=False):
+    """توافر كل يوم من start لـ end (date objects) — query واحدة grouped على Booking"""
+    snap = cached_settings()
+    rows = (db.session.query(Booking.date, Booking.slot)
+            .filter(Booking.date >= start, Booking.date <= end,
+                    Booking.status.in_(TAKEN_STATUSES))
+            .group_by(Booking.date, Booking.slot)
+            .all())
+    taken = {}
+    for date, minutes in rows:
+        i = snap.minute_index.get(minutes)
+        if i is not None:
+            taken[date] = taken.get(date, 0) | (1 << i)
+
+    days = {}
+    d    = start
+    while d <= end:
+        reason = closed_reason(d, snap)
+        if reason:
+            day = {'free': 0, 'error': reason}
+            if with_slots:
+                day['available_times'] = []
+        else:
+            free = _free_from_bits(snap, taken.get(d, 0), _past_cutoff(d))
+            day  = {'free': len(free)}
+            if with_slots:
+                day['available_times'] = free
+        days[d.strftime('%Y-%m-%d')] = day
+        d += timedelta(days=1)
+    return days
+
+
+def slot_status(d, slot):
+    """'free' / 'taken' / 'past' / 'invalid' — slot نص زي '3:00 PM'"""
+    snap, bits = _taken_bits(d)
+    i = snap.slot_index.get(slot)
+    if i is None:
+        return 'invalid'
+    if (bits >> i) & 1:
+        return 'taken'
+    if snap.slot_minutes[i] <= _past_cutoff(d):
+        return 'past'
+    return 'free'
+
+
+def availability_changed(d, minutes, taken):
+    """استدعيها بعد commit أي حجز/إلغاء/حضور — تحدّث الـ bitmap وتبلّغ باقي الـ workers"""
+    old, new = bump_stamp(_avail_stamp(d))
+    # الـ SSE streams على الـ worker ده تاخد الـ event فوراً — حتى لو الـ bitmap مش في الـ cache
+    slot_broadcaster.poke()
+    with _avail_lock:
+        e = _avail_cache.get(d)
+        if not e:
+            return
+        i = cached_settings().minute_index.get(minutes)
+        # لو الـ cache كان قديم أصلاً (worker تاني كتب) — سيبه يتحمّل من الـ DB
+        if old is None or e['stamp'] != old or i is None:
+            del _avail_cache[d]
+            return
+        e['bits']  = e['bits'] | (1 << i) if taken else e['bits'] & ~(1 << i)
+        e['stamp'] = new
+
+
+def availability_etag(days):
+    """ETag لتوافر الأيام دي — من الـ stamps والإعدادات بس، من غير DB
+    بيتغير مع: أي حجز/إلغاء/حضور في اليوم، تعديل الإعدادات، slot يفوت النهارده، أو AVAIL_TTL"""
+    snap = cached_settings()
+    h    = hashlib.blake2b(digest_size=12)
+    h.update(f"{snap.updated_at}|{int(time.time() // app.config['AVAIL_TTL'])}".encode())
+    for d in days:
+        past = bisect.bisect_right(snap.slot_minutes, _past_cutoff(d))
+        h.update(f"|{d}:{read_stamp(_avail_stamp(d))}:{past}".encode())
+    return h.hexdigest()
+
+
+def conditional_json(etag, build):
+    """304 من غير ما نحسب حاجة لو الـ client عنده نفس الـ ETag — وإلا jsonify(build())"""
+    if request.if_none_match.contains_weak(etag):   # W/ بعد الضغط — If-None-Match مقارنة weak
+        metrics.inc('cache_requests_total', cache='etag', result='hit')
+        resp = app.response_class(status=304)
+    else:
+        metrics.inc('cache_requests_total', cache='etag', result='miss')
+        resp = jsonify(build())
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = f"public, max-age={app.config['AVAIL_MAX_AGE']}"
+    return resp
 
-    return [s for s in slots if slot_to_minutes(s) > now_minutes]
+
+# ─────────────────────────────────────────────
+#  LIVE SLOTS — broadcaster واحد لكل worker بيوزّع على الـ SSE streams
+# ─────────────────────────────────────────────
+class SlotBroadcaster:
+    """thread واحد بيتابع الأيام اللي عليها subscribers:
+    كتابة في نفس الـ worker → poke() فوراً، وكتابة في worker تاني → الـ stamp بتاع اليوم (stat كل SSE_POLL)
+    أي تغيير = free_slots() مرة واحدة للـ worker كله، مهما كان عدد الصفحات المفتوحة"""
+    def __init__(self):
+        self._lock   = threading.Lock()
+        self._subs   = {}   # date → set(queue.Queue)
+        self._seen   = {}   # date → (etag, free slots)
+        self._wake   = threading.Event()
+        self._thread = None
+
+    def clients(self):
+        with self._lock:
+            return sum(len(qs) for qs in self._subs.values())
+
+    def subscribe(self, d, free):
+        q = queue.Queue(maxsize=8)
+        with self._lock:
+            self._subs.setdefault(d, set()).add(q)
+            self._seen.setdefault(d, (availability_etag([d]), free))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, d, q):
+        with self._lock:
+            qs = self._subs.get(d, set())
+            qs.discard(q)
+            if not qs:
+                self._subs.pop(d, None)
+                self._seen.pop(d, None)
+
+    def poke(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(app.config['SSE_POLL'])
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    self._check()
+            except Exception as e:
+                app.logger.error(f"Slot broadcaster error: {e}")
+
+    def _check(self):
+        with self._lock:
+            days = list(self._subs)
+        for d in days:
+            etag = availability_etag([d])
+            with self._lock:
+                seen = self._seen.get(d)
+            if seen is None or seen[0] == etag:
+                continue
+            free   = free_slots(d)
+            before = set(seen[1])
+            event  = {'date': d.strftime('%Y-%m-%d'), 'available_times': free,
+                      'taken': [t for t in seen[1] if t not in free],
+                      'freed': [t for t in free if t not in before]}
+            with self._lock:
+                self._seen[d] = (etag, free)
+                qs = list(self._subs.get(d, ()))
+            if not event['taken'] and not event['freed']:
+                continue
+            for q in qs:
+                try:
+                    q.put_nowait(event)
+                except queue.Full:
+                    pass   # client بطيء — الـ event الجاي فيه القائمة كاملة
 
 
-def upsert_patient(booking):
+slot_broadcaster = SlotBroadcaster()
+
+
+# ─────────────────────────────────────────────
+#  DASHBOARD ROLLUPS — بتتحدث في نفس الـ transaction بتاعة الكتابة
+# ─────────────────────────────────────────────
+def _stat_add(model, keys, n, column='count'):
+    """INSERT ... ON CONFLICT DO UPDATE — زوّد column بـ n (ممكن سالب)"""
+    if n == 0:
+        return
+    insert = pg_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    stmt   = insert(model).values(**keys, **{column: n})
+    stmt   = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={column: getattr(model.__table__.c, column) + n})
+    db.session.execute(stmt)
+
+
+def _split_conditions(conditions):
+    return {c.strip()[:100] for c in (conditions or '').split(',') if c.strip()}
+
+
+def stats_booking_added(b, sign=1):
+    _stat_add(DailyStat, {'date': b.date, 'status': b.status or 'confirmed'}, sign)
+    for c in b.condition_list:
+        _stat_add(ConditionStat, {'name': c.name}, sign)
+
+
+def stats_booking_removed(b):
+    stats_booking_added(b, sign=-1)
+    if b.rating:
+        stats_rating_added(b.rating.stars, sign=-1)
+
+
+def stats_status_changed(b, old_status):
+    if old_status == b.status:
+        return
+    _stat_add(DailyStat, {'date': b.date, 'status': old_status}, -1)
+    _stat_add(DailyStat, {'date': b.date, 'status': b.status}, 1)
+
+
+def stats_rating_added(stars, sign=1):
+    _stat_add(RatingStat, {'id': 1}, sign * stars, column='total')
+    _stat_add(RatingStat, {'id': 1}, sign, column='count')
+
+
+def stats_patient_added(sign=1):
+    _stat_add(PatientStat, {'id': 1}, sign)
+
+
+def rebuild_stats():
+    """امسح الـ rollups وابنيها من الأول من Booking/BookingRating/PatientProfile"""
+    DailyStat.query.delete()
+    ConditionStat.query.delete()
+    RatingStat.query.delete()
+    PatientStat.query.delete()
+    rows = (db.session.query(Booking.date, Booking.status, func.count())
+            .group_by(Booking.date, Booking.status).all())
+    db.session.add_all(DailyStat(date=d, status=st or 'confirmed', count=n) for d, st, n in rows)
+    rows = (db.session.query(Condition.name, func.count())
+            .join(booking_conditions, booking_conditions.c.condition_id == Condition.id)
+            .group_by(Condition.name).all())
+    db.session.add_all(ConditionStat(name=name, count=n) for name, n in rows)
+    total, count = db.session.query(func.coalesce(func.sum(BookingRating.stars), 0),
+                                    func.count(BookingRating.id)).one()
+    db.session.add(RatingStat(id=1, total=total, count=count))
+    db.session.add(PatientStat(id=1, count=PatientProfile.query.count()))
+    db.session.commit()
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """flask --app app rebuild-stats — أعد حساب أرقام الـ dashboard"""
+    rebuild_stats()
+    click.echo(f"Rebuilt stats: {DailyStat.query.count()} day/status rows, "
+               f"{ConditionStat.query.count()} conditions")
+
+
+def is_slot_conflict(e):
+    """الـ IntegrityError ده من uq_booking_active_slot؟ — مش أي unique تاني (زي phone المريض)
+    PostgreSQL بيقول اسم الـ constraint، SQLite بيقول الأعمدة بس"""
+    orig = getattr(e, 'orig', None)
+    name = getattr(getattr(orig, 'diag', None), 'constraint_name', None)
+    if name:
+        return name == 'uq_booking_active_slot'
+    return 'booking.date, booking.slot' in str(orig)
+
+
+def upsert_patient(booking, _retry=True):
+    visit = booking.date.strftime('%Y-%m-%d')
     p = PatientProfile.query.filter_by(phone=booking.phone).first()
     if p:
-        p.last_visit   = booking.date
+        p.last_visit   = visit
         p.total_visits = (p.total_visits or 0) + 1
         p.age          = booking.age
-        if booking.conditions:
-            old = {c.strip() for c in (p.conditions or '').split(',') if c.strip()}
-            new = {c.strip() for c in booking.conditions.split(',')   if c.strip()}
-            p.conditions = ', '.join(old | new)
+        missing = [c for c in booking.condition_list if c not in p.condition_list]
+        if missing:
+            p.condition_list.extend(missing)
+            p.conditions = ', '.join(c.name for c in p.condition_list)
         p.updated_at = datetime.utcnow()
     else:
         p = PatientProfile(
             name=booking.name, phone=booking.phone, age=booking.age,
-            conditions=booking.conditions,
-            first_visit=booking.date, last_visit=booking.date, total_visits=1)
-        db.session.add(p)
+            conditions=booking.conditions, condition_list=list(booking.condition_list),
+            first_visit=visit, last_visit=visit, total_visits=1)
+        try:
+            with db.session.begin_nested():
+                db.session.add(p)
+        except IntegrityError:
+            # أول حجز لنفس الرقم من request تاني في نفس اللحظة — حدّث الملف اللي اتعمل بدل ما الحجز يضيع
+            if not _retry:
+                raise
+            return upsert_patient(booking, _retry=False)
+        stats_patient_added()
     db.session.flush()
     return p
 
 
+# ─────────────────────────────────────────────
+#  PAGINATION — keyset (cursor) بدل OFFSET
+# ─────────────────────────────────────────────
+def page_size():
+    """?per_page= — محصور بين 1 و PAGE_SIZE_MAX"""
+    try:
+        n = int(request.args.get('per_page', app.config['PAGE_SIZE']))
+    except ValueError:
+        n = app.config['PAGE_SIZE']
+    return max(1, min(n, app.config['PAGE_SIZE_MAX']))
+
+
+def _encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, order):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(order):
+            return None
+        return [datetime.fromisoformat(v) if isinstance(col.type, db.DateTime) and v else
+                date.fromisoformat(v) if isinstance(col.type, db.Date) and v else v
+                for (col, _, _), v in zip(order, values)]
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_page(query, order, per_page):
+    """صفحة واحدة بعد ?after=<cursor>
+    order: [(expr, desc, getter)] — آخر عنصر لازم يكون unique (id)، getter بيجيب القيمة من الصف
+    بترجع (rows, next_cursor)"""
+    after  = request.args.get('after', '')
+    values = _decode_cursor(after, order) if after else None
+    if values:
+        clauses = []
+        for i, (col, desc, _) in enumerate(order):
+            same = [c == v for (c, _, _), v in zip(order[:i], values[:i])]
+            clauses.append(db.and_(*same, col < values[i] if desc else col > values[i]))
+        # bound زيادة على أول عمود — من غيره الـ OR بيخلي الـ planner يمشي الـ index من أوله (زي OFFSET)
+        first, desc, _ = order[0]
+        query = query.filter(first <= values[0] if desc else first >= values[0], db.or_(*clauses))
+    query = query.order_by(*[col.desc() if desc else col for col, desc, _ in order])
+    rows  = query.limit(per_page + 1).all()
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    return rows, _encode_cursor([get(rows[-1]) for _, _, get in order])
+
+
+def page_url(**changes):
+    """نفس الصفحة بنفس الفلاتر مع تغيير بعض الـ args (None = شيله)"""
+    args = request.args.to_dict()
+    for k, v in changes.items():
+        if v is None:
+            args.pop(k, None)
+        else:
+            args[k] = v
+    return url_for(request.endpoint, **args)
+
+
+# ─────────────────────────────────────────────
+#  SEARCH — فلتر موحد لـ /bookings و /patients
+# ─────────────────────────────────────────────
+# كل صف في search_fts (SQLite) الـ rowid بتاعه = id * 4 + نوعه
+SEARCH_KIND = {'booking': 1, 'patient_profile': 2, 'session_note': 3}
+_search_backend = {}
+
+
+def _fts_enabled():
+    """فيه search_fts (SQLite FTS5)؟ — بيتحسب مرة واحدة"""
+    if 'fts' not in _search_backend:
+        _search_backend['fts'] = (db.engine.dialect.name == 'sqlite'
+                                  and db.inspect(db.engine).has_table('search_fts'))
+    return _search_backend['fts']
+
+
+def _prefix(col, p):
+    """col LIKE 'p%' مكتوبة كـ range — عشان تستخدم الـ btree index"""
+    return db.and_(col >= p, col < p[:-1] + chr(ord(p[-1]) + 1))
+
+
+def _fts_ids(table, q):
+    """ids الصفوف من table اللي نصها فيه q (FTS5 trigram)"""
+    kind   = SEARCH_KIND[table]
+    phrase = '"' + q.replace('"', '""') + '"'
+    return (text(f'SELECT rowid / 4 AS ref FROM search_fts '
+                 f'WHERE search_fts MATCH :fts_q{kind} AND rowid % 4 = {kind}')
+            .bindparams(**{f'fts_q{kind}': phrase})
+            .columns(db.column('ref', db.Integer)))
+
+
+def _text_match(model, q):
+    if _fts_enabled() and len(q) >= 3:
+        return model.id.in_(_fts_ids(model.__tablename__, q))
+    # PostgreSQL: الـ ILIKE بيستخدم الـ pg_trgm GIN index
+    return model.name.ilike(f'%{q}%')
+
+
+def _notes_match(q):
+    if _fts_enabled() and len(q) >= 3:
+        return SessionNote.id.in_(_fts_ids('session_note', q))
+    return db.or_(SessionNote.diagnosis.ilike(f'%{q}%'),
+                  SessionNote.treatment.ilike(f'%{q}%'))
+
+
+def search_filter(model, q, include_notes=False):
+    """شرط البحث لـ Booking أو PatientProfile
+    أرقام → أول أو آخر رقم الهاتف (index range)، نص → الاسم (FTS5 / pg_trgm)
+    include_notes → كمان التشخيص/العلاج في SessionNote"""
+    q      = q.strip()
+    digits = q.replace(' ', '').lstrip('+')
+    if digits.isdigit():
+        return db.or_(_prefix(model.phone, digits), _prefix(model.phone_rev, digits[::-1]))
+    clauses = [_text_match(model, q)]
+    if include_notes:
+        link = SessionNote.booking_id if model is Booking else SessionNote.patient_id
+        clauses.append(model.id.in_(db.select(link).where(_notes_match(q))))
+    return db.or_(*clauses)
+
+
 def admin_required(f):
     @wraps(f)
     def dec(*a, **kw):
@@ -351,6 +1932,484 @@ def admin_required(f):
     return dec
 
 
+# ─────────────────────────────────────────────
+#  MIGRATIONS — versioned، بتتنفذ بالترتيب مرة واحدة
+# ─────────────────────────────────────────────
+MIGRATIONS = []                 # (version, name, fn)
+PENDING_MIGRATIONS = {}         # version → (name, reason) — بتظهر في الداشبورد و `flask migrate`
+MIGRATION_LOCK_KEY = 7262001    # مفتاح الـ advisory lock في PostgreSQL
+
+try:
+    import fcntl
+except ImportError:             # Windows — بدون file lock
+    fcntl = None
+
+
+def migration(version, name):
+    """سجّل function كـ migration رقم version"""
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return register
+
+
+@contextmanager
+def _migration_lock():
+    """lock واحد بين كل الـ workers — advisory lock في PostgreSQL، file lock في SQLite"""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:k)'), {'k': MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:k)'), {'k': MIGRATION_LOCK_KEY})
+                conn.commit()
+        return
+    os.makedirs(app.config['STAMP_DIR'], exist_ok=True)
+    with open(_stamp_path('migrate.lock'), 'w') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def run_migrations():
+    """create_all + أي migration لسه ما اتنفذتش — آمنة لو أكتر من worker بدأ في نفس الوقت
+    migration بترجع نص = لسه مش جاهزة (البيانات محتاجة تدخل يدوي) والنص هو السبب —
+    ما تتسجلش، بتفضل في PENDING_MIGRATIONS وتتجرب تاني المرة الجاية"""
+    with _migration_lock():
+        db.create_all()
+        done = {v for (v,) in db.session.query(SchemaMigration.version)}
+        PENDING_MIGRATIONS.clear()
+        for version, name, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version in done:
+                continue
+            reason = fn()
+            if reason:
+                db.session.rollback()
+                PENDING_MIGRATIONS[version] = (name, reason)
+                app.logger.error(f"Migration {version} deferred: {name} — {reason}")
+                continue
+            db.session.add(SchemaMigration(version=version, name=name))
+            db.session.commit()
+            app.logger.info(f"Migration {version} applied: {name}")
+
+
+def load_pending_migrations():
+    """AUTO_MIGRATE=0 — الـ worker ما شغّلش الـ migrations، بس لازم يعرف اللي لسه ما اتنفذش"""
+    done = {v for (v,) in db.session.query(SchemaMigration.version)}
+    PENDING_MIGRATIONS.clear()
+    for version, name, _ in MIGRATIONS:
+        if version not in done:
+            PENDING_MIGRATIONS[version] = (name, 'not applied yet — run `flask migrate`')
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """flask --app app migrate — نفّذ الـ migrations يدوياً (exit code ≠ 0 لو فيه migration متأجلة)"""
+    run_migrations()
+    for m in SchemaMigration.query.order_by(SchemaMigration.version).all():
+        click.echo(f"{m.version:>4}  {m.name}  ({m.applied_at:%Y-%m-%d %H:%M})")
+    if PENDING_MIGRATIONS:
+        for version, (name, reason) in sorted(PENDING_MIGRATIONS.items()):
+            click.echo(f"{version:>4}  {name}  (pending)\n      {reason}", err=True)
+        raise click.ClickException(f"{len(PENDING_MIGRATIONS)} migration(s) pending")
+
+
+@migration(1, 'typed booking/session dates')
+def upgrade_typed_dates():
+    """ترحيل date/appointment النصية لـ Date + slot (دقائق) — بيتنفذ مرة واحدة بس"""
+    insp = db.inspect(db.engine)
+    for table in ('booking', 'session_note'):
+        cols = {c['name'] for c in insp.get_columns(table)}
+        if 'appointment' not in cols:
+            continue
+        with db.engine.begin() as conn:
+            if 'slot' not in cols:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN slot INTEGER'))
+            rows   = conn.execute(text(f'SELECT id, appointment FROM {table}')).all()
+            params = [{'id': rid, 'slot': slot_to_minutes(a) if a and a.strip() else None}
+                      for rid, a in rows]
+            if params:
+                conn.execute(text(f'UPDATE {table} SET slot = :slot WHERE id = :id'), params)
+            # SQLite بيخزن الـ Date كنص 'YYYY-MM-DD' أصلاً — PostgreSQL محتاج تحويل النوع
+            if db.engine.dialect.name == 'postgresql':
+                conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN date TYPE DATE USING date::date'))
+            conn.execute(text(f'ALTER TABLE {table} DROP COLUMN appointment'))
+        app.logger.info(f"Migrated {table}: {len(rows)} rows → typed date/slot")
+
+
+def _create_indexes(model, *names):
+    """اعمل الـ indexes دي (المعرّفة على الـ model) لو مش موجودة"""
+    for index in model.__table__.indexes:
+        if index.name in names:
+            index.create(db.engine, checkfirst=True)
+
+
+@migration(2, 'composite booking indexes')
+def add_booking_indexes():
+    """indexes للـ queries التقيلة: (date, status[, reminder_sent]), phone, (status, created_at)"""
+    _create_indexes(Booking, 'ix_booking_date_slot', 'ix_booking_date_status_remind',
+                    'ix_booking_phone_date', 'ix_booking_status_created')
+
+
+@migration(3, 'backfill dashboard rollups')
+def backfill_stats():
+    rebuild_stats()
+
+
+@migration(4, 'normalized conditions')
+def backfill_conditions():
+    """فك النصوص المفصولة بفاصلة لـ Condition + جداول الربط"""
+    sources = [(Booking, booking_conditions, 'booking_id'),
+               (PatientProfile, patient_conditions, 'patient_id')]
+    pairs, names = [], set()
+    for model, _, _ in sources:
+        rows = (db.session.query(model.id, model.conditions)
+                .filter(model.conditions != '', model.conditions != None).yield_per(1000))
+        split = [(rid, _split_conditions(c)) for rid, c in rows]
+        pairs.append(split)
+        for _, n in split:
+            names |= n
+    ids = {c.name: c.id for c in get_conditions(names)}
+    for (model, table, fk), split in zip(sources, pairs):
+        rows = [{fk: rid, 'condition_id': ids[n]} for rid, ns in split for n in ns]
+        if rows:
+            db.session.execute(table.insert(), rows)
+    db.session.commit()
+    # migration 3 اتنفذ قبل جداول الربط ما تتملي — أعد حساب الـ rollups
+    rebuild_stats()
+
+
+_FTS_SOURCES = [
+    # (table, body expression, columns اللي تغييرها يحدّث الـ index)
+    ('booking',         '{r}.name', 'name'),
+    ('patient_profile', '{r}.name', 'name'),
+    ('session_note',    "coalesce({r}.diagnosis, '') || ' ' || coalesce({r}.treatment, '')",
+                        'diagnosis, treatment'),
+]
+
+
+def _setup_sqlite_fts(conn):
+    conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts "
+                      "USING fts5(body, tokenize='trigram')"))
+    for table, body, cols in _FTS_SOURCES:
+        kind  = SEARCH_KIND[table]
+        new_b = body.format(r='new')
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO search_fts(rowid, body) VALUES (new.id * 4 + {kind}, {new_b}); END"))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+            f"DELETE FROM search_fts WHERE rowid = old.id * 4 + {kind}; "
+            f"INSERT INTO search_fts(rowid, body) VALUES (new.id * 4 + {kind}, {new_b}); END"))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN "
+            f"DELETE FROM search_fts WHERE rowid = old.id * 4 + {kind}; END"))
+        conn.execute(text(
+            f"INSERT INTO search_fts(rowid, body) "
+            f"SELECT id * 4 + {kind}, {body.format(r=table)} FROM {table}"))
+
+
+def _setup_pg_trgm(conn):
+    conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    for table, col in [('booking', 'name'), ('patient_profile', 'name'),
+                       ('session_note', 'diagnosis'), ('session_note', 'treatment')]:
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_{col}_trgm '
+                          f'ON {table} USING gin ({col} gin_trgm_ops)'))
+
+
+@migration(5, 'search indexes (phone_rev + FTS5 / pg_trgm)')
+def add_search_indexes():
+    insp = db.inspect(db.engine)
+    for model in (Booking, PatientProfile):
+        table = model.__tablename__
+        if 'phone_rev' not in {c['name'] for c in insp.get_columns(table)}:
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN phone_rev VARCHAR(20)'))
+                rows = conn.execute(text(f'SELECT id, phone FROM {table}')).all()
+                if rows:
+                    conn.execute(text(f'UPDATE {table} SET phone_rev = :rev WHERE id = :id'),
+                                 [{'id': rid, 'rev': (p or '')[::-1]} for rid, p in rows])
+        _create_indexes(model, f'ix_{table}_phone_rev')
+
+    # FTS5 / pg_trgm اختياريين — لو مش متاحين البحث بيرجع لـ ILIKE
+    setup = {'sqlite': _setup_sqlite_fts, 'postgresql': _setup_pg_trgm}.get(db.engine.dialect.name)
+    if setup:
+        try:
+            with db.engine.begin() as conn:
+                setup(conn)
+        except Exception as e:
+            app.logger.warning(f"Search index setup skipped: {e}")
+    _search_backend.clear()
+
+
+@migration(6, 'unique active slot')
+def add_active_slot_index():
+    """partial unique index على (date, slot) للحجوزات الشغالة
+    لو فيه حجوزات مكررة (من الـ race القديم) ما نوقفش التشغيل — نأجل الـ index والمكرر بيظهر
+    في الداشبورد و `flask migrate` لحد ما الأدمن يلغي/يحذف المكرر، والـ migration تتجرب تاني مع كل تشغيل"""
+    dupes = (db.session.query(Booking.date, Booking.slot, func.count())
+             .filter(Booking.status.in_(TAKEN_STATUSES))
+             .group_by(Booking.date, Booking.slot)
+             .having(func.count() > 1).all())
+    if dupes:
+        listed = ', '.join(f"{d} {minutes_to_slot(s)} (x{n})" for d, s, n in dupes[:20])
+        return (f"{len(dupes)} slot(s) with more than one active booking — cancel or delete the extras, "
+                f"then restart or run `flask migrate`: {listed}")
+    _create_indexes(Booking, 'uq_booking_active_slot')
+
+
+@migration(7, 'rating page indexes')
+def add_rating_indexes():
+    _create_indexes(BookingRating, 'ix_booking_rating_created', 'ix_booking_rating_stars')
+
+
+@migration(8, 'doctor photo variants')
+def add_photo_version():
+    """عمود photo_version — ولو فيه صورة قديمة (doctor-clean.*) نعملها variants مرة واحدة"""
+    cols = {c['name'] for c in db.inspect(db.engine).get_columns('clinic_settings')}
+    if 'photo_version' not in cols:
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE clinic_settings ADD COLUMN photo_version VARCHAR(20) DEFAULT ''"))
+    if Image is None:
+        return
+    for ext in ALLOWED_EXT:
+        path = os.path.join(app.config['UPLOAD_FOLDER'], f'doctor-clean.{ext}')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                set_doctor_photo(f.read())
+            app.logger.info(f"Doctor photo {ext} → variants {get_settings().photo_version}")
+            break
+
+
+@migration(9, 'keyset sort indexes')
+def add_sort_indexes():
+    """indexes لترتيب الاسم في /bookings وآخر زيارة في /patients — و last_visit من غير NULL"""
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE patient_profile SET last_visit = '' WHERE last_visit IS NULL"))
+    _create_indexes(Booking, 'ix_booking_name_id')
+    _create_indexes(PatientProfile, 'ix_patient_last_visit_id')
+
+
+@migration(10, 'patient count rollup')
+def backfill_patient_stat():
+    """عدد المرضى للـ dashboard من PatientStat بدل COUNT(*) على patient_profile مع كل تحميل"""
+    db.session.merge(PatientStat(id=1, count=PatientProfile.query.count()))
+
+
+# ─────────────────────────────────────────────
+#  SEED — بيانات تجريبية بحجم production (deterministic من الـ seed)
+# ─────────────────────────────────────────────
+SEED_FIRST = ['محمد', 'أحمد', 'محمود', 'مصطفى', 'عمر', 'يوسف', 'علي', 'حسن', 'خالد', 'إبراهيم',
+              'فاطمة', 'مريم', 'نور', 'سارة', 'هدى', 'منى', 'آية', 'ياسمين', 'دينا', 'رحاب']
+SEED_LAST  = ['عبد الله', 'السيد', 'حسن', 'إبراهيم', 'عبد الرحمن', 'فتحي', 'سعيد', 'منصور',
+              'الشريف', 'عادل', 'جمال', 'صلاح', 'رمضان', 'فؤاد', 'النجار', 'الهادي']
+SEED_PAIN  = ['ألم أسفل الظهر', 'خشونة الركبة', 'انزلاق غضروفي', 'ألم الرقبة', 'تيبس الكتف',
+              'إصابة ملاعب', 'ألم بعد عملية', 'التواء الكاحل', 'شد عضلي', 'Back pain', 'Knee pain']
+SEED_CONDITIONS = [('Diabetes', 0.18), ('High Blood Pressure', 0.22), ('Old Injury', 0.15),
+                   ('Osteoporosis', 0.04), ('Heart Disease', 0.03)]
+SEED_PROGRESS   = ['ممتاز', 'جيد', 'لا تحسن', 'تراجع']
+SEED_STARS      = [5, 4, 3, 2, 1]
+
+
+def _bulk_insert(table, rows):
+    """INSERT جماعي — COPY في PostgreSQL، executemany في غيره"""
+    if not rows:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        cols = list(rows[0])
+        buf  = io.StringIO()
+        w    = csv.writer(buf)
+        for r in rows:
+            w.writerow([r[c].isoformat() if isinstance(r[c], (date, datetime)) else r[c]
+                        for c in cols])
+        buf.seek(0)
+        cur = db.session.connection().connection.cursor()
+        cur.copy_expert(f"COPY {table.name} ({', '.join(cols)}) FROM STDIN WITH (FORMAT csv)", buf)
+    else:
+        db.session.execute(table.insert(), rows)
+
+
+def seed_data(bookings=200_000, patients=20_000, days_ahead=30, seed=1, batch=10_000, echo=None):
+    """املا DB فاضية بمرضى وحجوزات وملاحظات وتقييمات — bulk inserts بـ ids محددة مسبقاً"""
+    echo = echo or (lambda msg: None)
+    if db.session.query(Booking.id).first() or db.session.query(PatientProfile.id).first():
+        raise RuntimeError("seed needs an empty booking/patient_profile table")
+    rng   = random.Random(seed)
+    snap  = cached_settings()
+    today = egypt_today()
+
+    # ── المرضى — أرقام فريدة، أسماء وأعمار وحالات مرضية ──
+    conds = {c.name: c.id for c in get_conditions([n for n, _ in SEED_CONDITIONS])}
+    numbers = rng.sample(range(10**8), patients)
+    people  = []
+    for i, num in enumerate(numbers):
+        names = sorted(n for n, p in SEED_CONDITIONS if rng.random() < p)
+        people.append({
+            'id':    i + 1,
+            'name':  f"{rng.choice(SEED_FIRST)} {rng.choice(SEED_FIRST)} {rng.choice(SEED_LAST)}",
+            'phone': f"{rng.choice(['010', '011', '012', '015'])}{num:08d}",
+            'age':   int(rng.triangular(6, 85, 45)),
+            'conds': names})
+    # قلة من المرضى بيعملوا أغلب الزيارات (توزيع Zipf تقريباً)
+    cum, total = [], 0.0
+    for i in range(patients):
+        total += 1 / (i + 1) ** 0.7
+        cum.append(total)
+    for start in range(0, patients, batch):
+        chunk = people[start:start + batch]
+        _bulk_insert(PatientProfile.__table__, [{
+            'id': p['id'], 'name': p['name'], 'phone': p['phone'], 'phone_rev': p['phone'][::-1],
+            'age': p['age'], 'conditions': ', '.join(p['conds']) or None, 'total_visits': 0, 'last_visit': '',
+            'created_at': datetime.utcnow(), 'updated_at': datetime.utcnow()} for p in chunk])
+        _bulk_insert(patient_conditions, [{'patient_id': p['id'], 'condition_id': conds[n]}
+                                          for p in chunk for n in p['conds']])
+    db.session.commit()
+    echo(f"patients: {patients}")
+
+    # ── الحجوزات — من تاريخ بداية محسوب لحد today + days_ahead ──
+    per_day  = len(snap.slot_minutes) * 0.84 * len(snap.work_days) / 7
+    d        = today - timedelta(days=int(bookings / max(per_day, 0.1)))
+    last_day = today + timedelta(days=days_ahead)
+    visits   = {}
+    made = notes = ratings = 0
+    rows, links, note_rows, rating_rows = [], [], [], []
+
+    def flush():
+        _bulk_insert(Booking.__table__, rows)
+        _bulk_insert(booking_conditions, links)
+        _bulk_insert(SessionNote.__table__, note_rows)
+        _bulk_insert(BookingRating.__table__, rating_rows)
+        db.session.commit()
+        for lst in (rows, links, note_rows, rating_rows):
+            lst.clear()
+
+    def book(day, minutes, status):
+        nonlocal made, notes, ratings
+        made += 1
+        p = people[bisect.bisect_left(cum, rng.random() * total)]
+        created = (datetime.combine(day, datetime.min.time())
+                   - timedelta(days=rng.randint(0, 14), minutes=rng.randint(0, 1439)))
+        rows.append({
+            'id': made, 'name': p['name'], 'age': p['age'], 'phone': p['phone'],
+            'phone_rev': p['phone'][::-1], 'pain': rng.choice(SEED_PAIN),
+            'conditions': ', '.join(p['conds']) or None, 'date': day, 'slot': minutes,
+            'status': status, 'cancel_token': f"{rng.getrandbits(192):048x}",
+            'created_at': created, 'reminder_sent': day < today})
+        links.extend({'booking_id': made, 'condition_id': conds[n]} for n in p['conds'])
+        first, last, n = visits.get(p['id'], (day, day, 0))
+        visits[p['id']] = (min(first, day), max(last, day), n + 1)
+        if status == 'attended' and rng.random() < 0.6:
+            notes += 1
+            note_rows.append({
+                'id': notes, 'patient_id': p['id'], 'booking_id': made, 'date': day,
+                'slot': minutes, 'complaint': rows[-1]['pain'],
+                'diagnosis': 'تقييم مبدئي وتحديد خطة العلاج', 'treatment': 'علاج طبيعي + تمارين',
+                'progress': rng.choice(SEED_PROGRESS), 'next_session': 'بعد أسبوع',
+                'created_at': created})
+        if status == 'attended' and rng.random() < 0.3:
+            ratings += 1
+            rating_rows.append({
+                'id': ratings, 'booking_id': made,
+                'stars': rng.choices(SEED_STARS, weights=[50, 30, 12, 5, 3])[0],
+                'comment': None, 'created_at': created + timedelta(days=rng.randint(1, 15))})
+
+    while d <= last_day and made < bookings:
+        if closed_reason(d, snap) is None:
+            ahead = (d - today).days
+            fill  = 0.8 if ahead < 0 else 0.05 + 0.7 * (1 - ahead / max(days_ahead, 1))
+            for minutes in snap.slot_minutes:
+                if made >= bookings or rng.random() >= fill:
+                    continue
+                if ahead < 0:
+                    r = rng.random()
+                    status = 'attended' if r < 0.78 else 'cancelled' if r < 0.9 else 'confirmed'
+                else:
+                    status = 'cancelled' if rng.random() < 0.1 else 'confirmed'
+                book(d, minutes, status)
+                # الميعاد الملغي بيتحجز تاني أحياناً — حجز شغال واحد بس لكل slot
+                if status == 'cancelled' and made < bookings and rng.random() < 0.4:
+                    book(d, minutes, 'attended' if ahead < 0 else 'confirmed')
+                if len(rows) >= batch:
+                    flush()
+                    echo(f"bookings: {made}/{bookings}  ({d})")
+        d += timedelta(days=1)
+    flush()
+
+    # ── إجماليات ملف المريض (نفس اللي upsert_patient بيعمله) ──
+    updates = [{'id': pid, 'first_visit': f.strftime('%Y-%m-%d'), 'last_visit': l.strftime('%Y-%m-%d'),
+                'total_visits': n} for pid, (f, l, n) in visits.items()]
+    for start in range(0, len(updates), batch):
+        db.session.execute(db.update(PatientProfile), updates[start:start + batch])
+    db.session.commit()
+    if db.engine.dialect.name == 'postgresql':
+        for table in ('patient_profile', 'booking', 'session_note', 'booking_rating'):
+            db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                    f"COALESCE((SELECT MAX(id) FROM {table}), 1))"))
+        db.session.commit()
+    rebuild_stats()
+    return {'patients': patients, 'bookings': made, 'session_notes': notes, 'ratings': ratings}
+
+
+@app.cli.command('seed')
+@click.option('--bookings',   default=200_000, show_default=True)
+@click.option('--patients',   default=20_000,  show_default=True)
+@click.option('--days-ahead', default=30,      show_default=True)
+@click.option('--seed',       'seed_value', default=1, show_default=True, help='نفس الـ seed = نفس البيانات')
+@click.option('--batch',      default=10_000,  show_default=True)
+def seed_command(bookings, patients, days_ahead, seed_value, batch):
+    """flask --app app seed — بيانات تجريبية للـ benchmarks (DB فاضية بس)"""
+    t0 = time.perf_counter()
+    try:
+        counts = seed_data(bookings, patients, days_ahead, seed_value, batch, echo=click.echo)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Seeded {counts} in {time.perf_counter() - t0:.1f}s")
+
+
+# ─────────────────────────────────────────────
+#  STARTUP
+# ─────────────────────────────────────────────
+load_assets()
+
+with app.app_context():
+    instrument_pool(db.engine)
+    # broadcaster + outbox dispatcher + reminders + OUTBOX_WORKERS — كلهم بياخدوا connections
+    _pool_opts = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    _db_slots  = _pool_opts['pool_size'] + _pool_opts['max_overflow']
+    _db_users  = app.config['WEB_THREADS'] + 3 + app.config['OUTBOX_WORKERS']
+    if _db_users > _db_slots:
+        app.logger.warning(f"WEB_THREADS={app.config['WEB_THREADS']} + background threads need {_db_users} "
+                           f"DB connections but the pool allows {_db_slots} (pool_size + max_overflow)")
+    if app.config['SSE_MAX_CLIENTS'] >= app.config['WEB_THREADS']:
+        app.logger.warning(f"SSE_MAX_CLIENTS={app.config['SSE_MAX_CLIENTS']} leaves no threads for "
+                           f"normal requests (WEB_THREADS={app.config['WEB_THREADS']})")
+    # AUTO_MIGRATE=0 لو عايز تشغّلها يدوياً بـ `flask migrate` قبل الـ deploy
+    if os.getenv('AUTO_MIGRATE', '1') == '1':
+        run_migrations()
+    else:
+        load_pending_migrations()
+    # تصحيح الإعدادات القديمة لو start_hour < 8 (يعني مخزّن بالطريقة القديمة)
+    old_settings = ClinicSettings.query.first()
+    if old_settings and old_settings.start_hour < 8:
+        old_settings.start_hour = old_settings.start_hour + 12  # 3 → 15
+        if old_settings.end_hour < 12:
+            old_settings.end_hour = old_settings.end_hour + 12  # 11 → 23
+        db.session.commit()
+
+    # seed الأدمن من الـ env variables لو DB فاضي
+    if not AdminCredentials.query.first():
+        env_user = os.getenv("ADMIN_USERNAME", "admin")
+        env_hash = os.getenv("ADMIN_PASSWORD", "")
+        if env_hash:
+            db.session.add(AdminCredentials(username=env_user, password_hash=env_hash))
+            db.session.commit()
+
+
 # ─────────────────────────────────────────────
 #  FORMS
 # ─────────────────────────────────────────────
@@ -393,43 +2452,153 @@ class DoctorNotesForm(FlaskForm):
 
 
 # ─────────────────────────────────────────────
-#  SMS  (Twilio — للمريض)
+#  NOTIFICATION TRANSPORTS — clients طويلة العمر بـ keep-alive pool
 # ─────────────────────────────────────────────
-def send_sms(to_phone, message):
-    """إرسال SMS عبر Twilio للمريض"""
-    try:
-        from twilio.rest import Client
-        sid   = os.getenv("TWILIO_ACCOUNT_SID")
-        token = os.getenv("TWILIO_AUTH_TOKEN")
-        from_ = os.getenv("TWILIO_FROM_NUMBER")
-        if not all([sid, token, from_]):
+class TwilioTransport:
+    """SMS للمريض — Client واحد لكل worker فوق HTTPS session بـ pool ثابت"""
+    def __init__(self, pool_size):
+        self.sid       = os.getenv("TWILIO_ACCOUNT_SID")
+        self.token     = os.getenv("TWILIO_AUTH_TOKEN")
+        self.from_     = os.getenv("TWILIO_FROM_NUMBER")
+        self.pool_size = pool_size
+        self._client   = None
+        self._lock     = threading.Lock()
+
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from twilio.rest import Client
+                    from twilio.http.http_client import TwilioHttpClient
+                    from requests.adapters import HTTPAdapter
+                    http_client = TwilioHttpClient(pool_connections=True,
+                                                   timeout=app.config['NOTIFY_TIMEOUT'])
+                    http_client.session.mount('https://', HTTPAdapter(
+                        pool_connections=1, pool_maxsize=self.pool_size, pool_block=True))
+                    self._client = Client(self.sid, self.token, http_client=http_client)
+        return self._client
+
+    def send(self, to_phone, message):
+        if not all([self.sid, self.token, self.from_]):
             app.logger.info("Twilio not configured, skipping SMS")
-            return
+            return False
         # الرقم المصري: نضيف +2 في الأول لو مش موجود
         if not to_phone.startswith('+'):
             to_phone = '+2' + to_phone
-        client = Client(sid, token)
-        client.messages.create(body=message, from_=from_, to=to_phone)
-        app.logger.info(f"SMS sent to {to_phone}")
-    except Exception as e:
-        app.logger.error(f"SMS error: {e}")
+        self.client().messages.create(body=message, from_=self.from_, to=to_phone)
+        return True
+
+
+class CallMeBotTransport:
+    """واتساب للدكتور — connections HTTPS بـ keep-alive بيترجعوا للـ pool بعد كل رسالة"""
+    HOST = 'api.callmebot.com'
+
+    def __init__(self, pool_size):
+        self.api_key = os.getenv("CALLMEBOT_API_KEY")
+        self.idle    = queue.LifoQueue(maxsize=pool_size)
+
+    def _request(self, conn, path):
+        conn.request('GET', path)
+        resp = conn.getresponse()
+        resp.read()   # لازم الـ body يتقري عشان الـ connection يتعاد استخدامه
+        return resp
+
+    def send(self, phone, message):
+        if not self.api_key:
+            return False
+        path = (f"/whatsapp.php?phone={phone}"
+                f"&text={urllib.parse.quote(message)}&apikey={self.api_key}")
+        try:
+            conn, reused = self.idle.get_nowait(), True
+        except queue.Empty:
+            conn, reused = None, False
+        try:
+            if conn is None:
+                conn = http.client.HTTPSConnection(self.HOST, timeout=app.config['NOTIFY_TIMEOUT'])
+            try:
+                resp = self._request(conn, path)
+            except (http.client.HTTPException, ConnectionError):
+                if not reused:
+                    raise
+                # السيرفر قفل الـ connection القديمة وهي idle — جرّب مرة بواحدة جديدة
+                conn.close()
+                conn = http.client.HTTPSConnection(self.HOST, timeout=app.config['NOTIFY_TIMEOUT'])
+                resp = self._request(conn, path)
+        except Exception:
+            if conn is not None:
+                conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            try:
+                self.idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+        if resp.status >= 400:
+            raise RuntimeError(f"CallMeBot HTTP {resp.status}")
+        return True
+
+
+class LocalTransport:
+    """stand-in للتجارب والـ benchmarks — بيحفظ الرسايل في الذاكرة بدل ما يبعت"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent    = deque(maxlen=1000)
+
+    def send(self, to, message):
+        if self.latency:
+            time.sleep(self.latency)
+        self.sent.append((to, message))
+        return True
+
+
+LIVE_TRANSPORTS = {'sms': TwilioTransport, 'whatsapp': CallMeBotTransport}
+_transports     = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(channel):
+    """transport القناة — بيتعمل مرة واحدة لكل worker ويتعاد استخدامه"""
+    t = _transports.get(channel)
+    if t is None:
+        with _transports_lock:
+            t = _transports.get(channel)
+            if t is None:
+                if app.config['NOTIFY_TRANSPORT'] == 'local':
+                    t = LocalTransport(app.config['NOTIFY_LOCAL_LATENCY'])
+                else:
+                    t = LIVE_TRANSPORTS[channel](app.config['OUTBOX_CHANNEL_LIMIT'].get(channel, 1))
+                _transports[channel] = t
+    return t
+
+
+def deliver(channel, to, message):
+    """ابعت رسالة واحدة وسجّل الـ latency في notification_send_seconds — False لو القناة مش متظبطة، exception لو فشل"""
+    t0 = time.perf_counter()
+    try:
+        sent = get_transport(channel).send(to, message)
+    except Exception:
+        elapsed = time.perf_counter() - t0
+        metrics.observe('notification_send_seconds', elapsed, channel=channel)
+        metrics.inc('notifications_sent_total', channel=channel, result='error')
+        raise
+    if sent:
+        elapsed = time.perf_counter() - t0
+        metrics.observe('notification_send_seconds', elapsed, channel=channel)
+        app.logger.info(f"{channel} sent to {to} in {elapsed * 1000:.0f}ms")
+    metrics.inc('notifications_sent_total', channel=channel, result='sent' if sent else 'skipped')
+    return sent
+
+
+def send_sms(to_phone, message):
+    """إرسال SMS عبر Twilio للمريض"""
+    return deliver('sms', to_phone, message)
 
 
-# ─────────────────────────────────────────────
-#  WHATSAPP  (CallMeBot — للدكتور)
-# ─────────────────────────────────────────────
 def send_whatsapp(phone, message):
     """إرسال واتساب للدكتور عبر CallMeBot"""
-    try:
-        import urllib.request, urllib.parse
-        api_key = os.getenv("CALLMEBOT_API_KEY")
-        if not api_key:
-            return
-        url = (f"https://api.callmebot.com/whatsapp.php"
-               f"?phone={phone}&text={urllib.parse.quote(message)}&apikey={api_key}")
-        urllib.request.urlopen(url, timeout=10)
-    except Exception as e:
-        app.logger.error(f"WhatsApp error: {e}")
+    return deliver('whatsapp', phone, message)
 
 
 def get_doctor_phone():
@@ -437,7 +2606,7 @@ def get_doctor_phone():
 
 
 def notify_booking(name, phone, date, appointment):
-    """إشعار عند حجز جديد: SMS للمريض + واتساب للدكتور"""
+    """إشعار عند حجز جديد: SMS للمريض + واتساب للدكتور — قبل الـ commit"""
     # ── SMS للمريض ──
     patient_msg = (
         f"مركز الهادي للعلاج الطبيعي\n"
@@ -447,7 +2616,7 @@ def notify_booking(name, phone, date, appointment):
         f"الميعاد: {appointment}\n"
         f"يرجى الحضور قبل الموعد بـ 10 دقائق"
     )
-    threading.Thread(target=send_sms, args=(phone, patient_msg), daemon=True).start()
+    queue_notification('sms', phone, patient_msg)
 
     # ── واتساب للدكتور ──
     doctor = get_doctor_phone()
@@ -459,11 +2628,11 @@ def notify_booking(name, phone, date, appointment):
             f"التاريخ: {date}\n"
             f"الميعاد: {appointment}"
         )
-        threading.Thread(target=send_whatsapp, args=(doctor, doctor_msg), daemon=True).start()
+        queue_notification('whatsapp', doctor, doctor_msg)
 
 
 def notify_reminder(name, phone, date, appointment):
-    """تذكير قبل الموعد بـ 24 ساعة: SMS للمريض + واتساب للدكتور"""
+    """تذكير قبل الموعد بـ 24 ساعة: SMS للمريض + واتساب للدكتور — قبل الـ commit"""
     # ── SMS للمريض ──
     patient_msg = (
         f"تذكير - مركز الهادي للعلاج الطبيعي\n"
@@ -472,7 +2641,7 @@ def notify_reminder(name, phone, date, appointment):
         f"الميعاد: {appointment}\n"
         f"يرجى الحضور قبل الموعد بـ 10 دقائق"
     )
-    threading.Thread(target=send_sms, args=(phone, patient_msg), daemon=True).start()
+    queue_notification('sms', phone, patient_msg)
 
     # ── واتساب للدكتور ──
     doctor = get_doctor_phone()
@@ -484,37 +2653,274 @@ def notify_reminder(name, phone, date, appointment):
             f"التاريخ: {date}\n"
             f"الميعاد: {appointment}"
         )
-        threading.Thread(target=send_whatsapp, args=(doctor, doctor_msg), daemon=True).start()
+        queue_notification('whatsapp', doctor, doctor_msg)
 
 
 # ─────────────────────────────────────────────
-#  AUTO REMINDER — بيشتغل في background
+#  NOTIFICATION OUTBOX — dispatcher بـ pool ثابت
 # ─────────────────────────────────────────────
-def reminder_worker():
-    """بيشتغل كل ساعة ويبعت تذكير للمرضى اللي موعدهم بكره"""
-    import time
+_outbox_wake  = threading.Event()
+_outbox_slots = {ch: threading.BoundedSemaphore(n)
+                 for ch, n in app.config['OUTBOX_CHANNEL_LIMIT'].items()}
+_outbox_pool  = ThreadPoolExecutor(max_workers=app.config['OUTBOX_WORKERS'],
+                                   thread_name_prefix='outbox')
+
+
+def queue_notification(channel, to, body):
+    """ضيف إشعار للـ outbox — بيتحفظ مع الـ commit بتاع الـ request"""
+    db.session.add(Notification(channel=channel, to=to, body=body))
+
+
+def wake_outbox():
+    """بعد الـ commit — صحّي الـ dispatcher هنا وفي باقي الـ workers"""
+    _outbox_wake.set()
+    bump_stamp('outbox')
+
+
+def _claim_due(limit):
+    """خد إشعارات جاهزة للإرسال — الـ UPDATE المشروط بيمنع worker تاني ياخد نفس الصف"""
+    now   = datetime.utcnow()
+    stale = now - timedelta(seconds=app.config['OUTBOX_STALE'])
+    # worker اتقفل وهو بيبعت — رجّعها pending
+    Notification.query.filter(Notification.status == 'sending',
+                              Notification.claimed_at < stale)\
+                      .update({'status': 'pending'}, synchronize_session=False)
+    ids = [i for (i,) in db.session.query(Notification.id).filter(
+               Notification.status == 'pending',
+               Notification.next_attempt_at <= now)
+           .order_by(Notification.next_attempt_at).limit(limit)]
+    claimed = []
+    for nid in ids:
+        n = (Notification.query.filter_by(id=nid, status='pending')
+             .update({'status': 'sending', 'claimed_at': now}, synchronize_session=False))
+        if n:
+            claimed.append(nid)
+    db.session.commit()
+    return claimed
+
+
+def _deliver(nid):
+    """بيتنفذ جوه الـ pool — ابعت إشعار واحد وسجّل النتيجة"""
+    with app.app_context():
+        n = db.session.get(Notification, nid)
+        if not n:
+            return
+        slot = _outbox_slots.get(n.channel)
+        try:
+            if slot:
+                slot.acquire()
+            try:
+                sent = deliver(n.channel, n.to, n.body)
+            finally:
+                if slot:
+                    slot.release()
+            n.status  = 'sent' if sent else 'skipped'
+            n.sent_at = datetime.utcnow()
+            if sent and n.created_at:
+                metrics.observe('notification_queue_delay_seconds',
+                                (n.sent_at - n.created_at).total_seconds(), channel=n.channel)
+        except Exception as e:
+            n.attempts  += 1
+            n.last_error = str(e)[:500]
+            if n.attempts >= app.config['OUTBOX_MAX_ATTEMPTS']:
+                n.status = 'failed'
+                app.logger.error(f"{n.channel} #{n.id} failed after {n.attempts} attempts: {e}")
+            else:
+                n.status          = 'pending'
+                n.next_attempt_at = datetime.utcnow() + timedelta(
+                    seconds=app.config['OUTBOX_BACKOFF'] * 2 ** (n.attempts - 1))
+        db.session.commit()
+
+
+def outbox_dispatcher():
+    """بيصحى مع كل إشعار جديد (Event أو stamp من worker تاني) أو كل OUTBOX_POLL ثانية"""
+    stamp, last_poll = read_stamp('outbox'), 0.0
     while True:
-        time.sleep(3600)   # كل ساعة
+        woke = _outbox_wake.wait(timeout=1)
+        _outbox_wake.clear()
+        now = time.monotonic()
+        new_stamp = read_stamp('outbox')
+        if not woke and new_stamp == stamp and now - last_poll < app.config['OUTBOX_POLL']:
+            continue
+        stamp, last_poll = new_stamp, now
         try:
             with app.app_context():
-                tomorrow = (egypt_today() + timedelta(days=1)).strftime('%Y-%m-%d')
-                pending  = Booking.query.filter_by(
-                    date=tomorrow, status='confirmed', reminder_sent=False).all()
-                for b in pending:
-                    notify_reminder(b.name, b.phone, b.date, b.appointment)
-                    b.reminder_sent = True
-                db.session.commit()
-                if pending:
-                    app.logger.info(f"Reminders sent: {len(pending)}")
+                batch = _claim_due(app.config['OUTBOX_WORKERS'] * 4)
+            for f in [_outbox_pool.submit(_deliver, nid) for nid in batch]:
+                f.result()
+            if batch:
+                _outbox_wake.set()   # ممكن يكون فيه باقي
         except Exception as e:
-            app.logger.error(f"Reminder worker error: {e}")
+            app.logger.error(f"Outbox dispatcher error: {e}")
 
 
-# تشغيل الـ reminder في الخلفية عند بدء التطبيق
-threading.Thread(target=reminder_worker, daemon=True).start()
+# تشغيل الـ dispatcher في الخلفية عند بدء التطبيق
+threading.Thread(target=outbox_dispatcher, daemon=True).start()
+threading.Thread(target=metrics_flusher, daemon=True).start()
 
 
+# ─────────────────────────────────────────────
+#  AUTO REMINDER — scheduler واحد لكل الـ workers
+# ─────────────────────────────────────────────
+REMINDER_LOCK_KEY = 7262002     # مفتاح الـ advisory lock في PostgreSQL
+
+_reminder_wake = threading.Event()
+
 
+class Leadership:
+    """leader election — advisory lock على connection ثابتة في PostgreSQL، صف lease في SQLite"""
+    def __init__(self, name, key):
+        self.name   = name
+        self.key    = key
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.conn   = None
+        self.held   = False
+
+    def acquire(self):
+        """True لو الـ worker ده بقى (أو لسه) الـ leader"""
+        if db.engine.dialect.name == 'postgresql':
+            return self._pg_acquire()
+        return self._lease_acquire()
+
+    def _pg_acquire(self):
+        try:
+            if self.conn is None:
+                self.conn = db.engine.connect()
+                got = self.conn.execute(text('SELECT pg_try_advisory_lock(:k)'),
+                                        {'k': self.key}).scalar()
+                self.conn.commit()
+                if not got:
+                    self.release()
+                    return False
+            else:
+                # الـ lock بيعيش طول ما الـ connection عايشة
+                self.conn.execute(text('SELECT 1'))
+                self.conn.commit()
+            self.held = True
+        except Exception:
+            self.release()
+        return self.held
+
+    def _lease_acquire(self):
+        now, t = datetime.utcnow(), SchedulerLease.__table__
+        expires = now + timedelta(seconds=app.config['LEADER_LEASE'])
+        try:
+            with db.engine.begin() as conn:
+                renewed = conn.execute(
+                    t.update()
+                     .where(t.c.name == self.name,
+                            (t.c.holder == self.holder) | (t.c.expires_at < now))
+                     .values(holder=self.holder, expires_at=expires)).rowcount
+                if not renewed:
+                    conn.execute(t.insert().values(name=self.name, holder=self.holder,
+                                                   expires_at=expires))
+            self.held = True
+        except IntegrityError:      # worker تاني ماسك الـ lease
+            self.held = False
+        return self.held
+
+    def release(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()   # قفل الـ connection بيفك الـ advisory lock
+            except Exception:
+                pass
+            self.conn = None
+        elif self.held:
+            t = SchedulerLease.__table__
+            with db.engine.begin() as conn:
+                conn.execute(t.delete().where(t.c.name == self.name,
+                                              t.c.holder == self.holder))
+        self.held = False
+
+
+def _reminder_due_at(d, minutes):
+    """وقت إرسال تذكير موعد (date + slot) — naive بتوقيت القاهرة"""
+    return (datetime.combine(d, datetime.min.time()) + timedelta(minutes=minutes)
+            - app.config['REMINDER_LEAD'])
+
+
+def send_due_reminders():
+    """claim التذكيرات المستحقة على دفعات — FOR UPDATE SKIP LOCKED في PostgreSQL"""
+    horizon  = datetime.now(CAIRO).replace(tzinfo=None) + app.config['REMINDER_LEAD']
+    tomorrow = egypt_today() + timedelta(days=1)
+    # تذكير "بكره" بس — نفس رسالة notify_reminder
+    if tomorrow > horizon.date():
+        return 0
+    q = Booking.query.filter_by(date=tomorrow, status='confirmed', reminder_sent=False)
+    if tomorrow == horizon.date():
+        q = q.filter(Booking.slot <= horizon.hour * 60 + horizon.minute)
+    total = 0
+    while True:
+        batch = (q.order_by(Booking.slot).limit(app.config['REMINDER_BATCH'])
+                  .with_for_update(skip_locked=True).all())
+        for b in batch:
+            notify_reminder(b.name, b.phone, b.date, b.appointment)
+            b.reminder_sent = True
+        db.session.commit()
+        total += len(batch)
+        if len(batch) < app.config['REMINDER_BATCH']:
+            break
+    if total:
+        wake_outbox()
+        app.logger.info(f"Reminders queued: {total}")
+    return total
+
+
+def next_reminder_in():
+    """ثواني لحد أقرب تذكير لسه ما اتبعتش — REMINDER_MAX_SLEEP كحد أقصى"""
+    now      = datetime.now(CAIRO).replace(tzinfo=None)
+    tomorrow = egypt_today() + timedelta(days=1)
+    first    = (db.session.query(Booking.date, Booking.slot)
+                .filter_by(status='confirmed', reminder_sent=False)
+                .filter(Booking.date >= tomorrow)
+                .order_by(Booking.date, Booking.slot).first())
+    db.session.rollback()
+    wait = app.config['REMINDER_MAX_SLEEP']
+    if first:
+        d, minutes = first
+        # مواعيد بعد بكره بتستنى لحد ما تبقى "بكره"
+        due  = max(_reminder_due_at(d, minutes),
+                   datetime.combine(d - timedelta(days=1), datetime.min.time()))
+        wait = min(wait, max(0.0, (due - now).total_seconds()))
+    return wait
+
+
+def wake_reminders(d):
+    """بعد حجز جديد — لو ممكن تذكيره يبقى مستحق قبل نومة الـ scheduler الجاية"""
+    if d <= egypt_today() + timedelta(days=1):
+        _reminder_wake.set()
+        bump_stamp('reminders')
+
+
+def reminder_scheduler():
+    """worker واحد بس هو الـ leader — الباقيين بيحاولوا ياخدوا القيادة كل LEADER_LEASE/3"""
+    leader  = Leadership('reminders', REMINDER_LOCK_KEY)
+    renew   = app.config['LEADER_LEASE'] / 3
+    stamp   = read_stamp('reminders')
+    while True:
+        wait = renew
+        try:
+            with app.app_context():
+                if leader.acquire():
+                    send_due_reminders()
+                    wait = min(renew, next_reminder_in())
+        except Exception as e:
+            app.logger.error(f"Reminder scheduler error: {e}")
+        # نام لحد أقرب تذكير، أو لحد ما حجز جديد يصحّينا (هنا أو من worker تاني)
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            if _reminder_wake.wait(timeout=min(1.0, max(0.0, deadline - time.monotonic()))):
+                break
+            new_stamp = read_stamp('reminders')
+            if new_stamp != stamp:
+                stamp = new_stamp
+                break
+        _reminder_wake.clear()
+
+
+# تشغيل الـ scheduler في الخلفية عند بدء التطبيق
+threading.Thread(target=reminder_scheduler, daemon=True).start()
 
 
 # ─────────────────────────────────────────────
@@ -522,17 +2928,17 @@ threading.Thread(target=reminder_worker, daemon=True).start()
 # ─────────────────────────────────────────────
 @app.route('/')
 def index():
-    today = egypt_today().strftime('%Y-%m-%d')
-    date  = request.args.get('date', today)
-    ok, _ = valid_date(date)
+    today = egypt_today()
+    ok, d = valid_date(request.args.get('date', ''))
     if not ok:
-        date = today
+        d = today
 
-    free  = filter_past_slots([s for s in get_all_slots() if s not in booked_slots(date)], date)
+    free  = free_slots(d)
     form  = BookingForm()
     form.appointment.choices = [(t, t) for t in free] if free else [('', 'لا توجد مواعيد')]
-    form.date.data = datetime.strptime(date, '%Y-%m-%d')
-    return render_template('index.html', form=form, available_times=free, selected_date=date)
+    form.date.data = d
+    return render_template('index.html', form=form, available_times=free,
+                           selected_date=d.strftime('%Y-%m-%d'), photo=doctor_photo())
 
 
 @app.route('/available_slots')
@@ -544,7 +2950,65 @@ def available_slots():
     ok, result = valid_date(date)
     if not ok:
         return jsonify({'available_times': [], 'error': result})
-    return jsonify({'available_times': filter_past_slots([s for s in get_all_slots() if s not in booked_slots(date)], date)})
+    return conditional_json(availability_etag([result]),
+                            lambda: {'available_times': free_slots(result)})
+
+
+@app.route('/available_slots/range')
+@limiter.limit("10 per minute")
+def available_slots_range():
+    """توافر المواعيد لفترة كاملة (لحد 3 شهور) — للـ calendar في request واحد"""
+    today = egypt_today()
+    try:
+        start = datetime.strptime(request.args.get('from') or today.strftime('%Y-%m-%d'), '%Y-%m-%d').date()
+        end   = (datetime.strptime(request.args['to'], '%Y-%m-%d').date()
+                 if request.args.get('to') else start + timedelta(days=30))
+    except ValueError:
+        return jsonify({'days': {}, 'error': 'تاريخ غير صالح'})
+    start = max(start, today)
+    end   = min(end, start + timedelta(days=app.config['AVAIL_RANGE_MAX_DAYS']))
+    if end < start:
+        return jsonify({'days': {}, 'error': 'تاريخ غير صالح'})
+    with_slots = request.args.get('slots') == '1'
+    return conditional_json(
+        availability_etag([start + timedelta(days=i) for i in range((end - start).days + 1)]),
+        lambda: {'from': start.strftime('%Y-%m-%d'),
+                 'to':   end.strftime('%Y-%m-%d'),
+                 'days': range_availability(start, end, with_slots=with_slots)})
+
+
+@app.route('/available_slots/stream')
+@limiter.limit("20 per minute")
+def available_slots_stream():
+    """SSE — المواعيد الفاضية لليوم ده، وبعدها event مع كل حجز/إلغاء (taken / freed)"""
+    ok, d = valid_date(request.args.get('date', ''))
+    if not ok:
+        return jsonify({'error': d}), 400
+    if slot_broadcaster.clients() >= app.config['SSE_MAX_CLIENTS']:
+        # الـ worker مليان — الصفحة تكمّل بالـ fetch العادي (ETag)
+        return jsonify({'error': 'busy'}), 503, {'Retry-After': '30'}
+
+    free = free_slots(d)
+    q    = slot_broadcaster.subscribe(d, free)
+
+    def stream():
+        deadline = time.monotonic() + app.config['SSE_MAX_AGE']
+        try:
+            yield f"retry: {app.config['SSE_RETRY']}\n\n"
+            first = {'date': d.strftime('%Y-%m-%d'), 'available_times': free, 'taken': [], 'freed': []}
+            yield f"event: slots\ndata: {json.dumps(first, ensure_ascii=False)}\n\n"
+            while (left := deadline - time.monotonic()) > 0:
+                try:
+                    event = q.get(timeout=min(app.config['SSE_PING'], left))
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: slots\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            slot_broadcaster.unsubscribe(d, q)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/submit', methods=['POST'])
@@ -555,7 +3019,7 @@ def submit():
     pain        = request.form.get('pain', '').strip()
     date_str    = request.form.get('date', '').strip()
     appointment = request.form.get('appointment', '').strip()
-    conditions  = request.form.getlist('conditions')
+    conditions  = allowed_conditions(request.form.getlist('conditions'))
     age_str     = request.form.get('age', '').strip()
 
     # ✅ فحص أولي — لو الرقم مسجل مسبقاً وجّهه لصفحة المرضى القدامى
@@ -573,15 +3037,17 @@ def submit():
         age = int(age_str)
         if not (1 <= age <= 120):          errors.append("العمر غير منطقي")
     except:                                 errors.append("العمر غير صالح")
+    date_ok = False
     if not date_str:                        errors.append("التاريخ مطلوب")
     else:
-        ok, res = valid_date(date_str)
-        if not ok:                         errors.append(res)
+        date_ok, res = valid_date(date_str)
+        if not date_ok:                    errors.append(res)
     if not appointment:                    errors.append("يرجى اختيار ميعاد")
-    elif date_str and appointment in booked_slots(date_str):
-                                           errors.append("هذا الموعد محجوز بالفعل")
-    elif date_str and not filter_past_slots([appointment], date_str):
-                                           errors.append("هذا الميعاد قد مضى، يرجى اختيار ميعاد آخر")
+    elif date_ok:
+        st = slot_status(res, appointment)
+        if st == 'taken':                  errors.append("هذا الموعد محجوز بالفعل")
+        elif st == 'past':                 errors.append("هذا الميعاد قد مضى، يرجى اختيار ميعاد آخر")
+        elif st == 'invalid':              errors.append("يرجى اختيار ميعاد")
     if errors:
         for e in errors: flash(e, 'error')
         return redirect('/')
@@ -590,14 +3056,22 @@ def submit():
     try:
         b = Booking(
             name=html.escape(name), age=age, phone=phone,
-            pain=html.escape(pain), conditions=', '.join(conditions),
-            date=date_str, appointment=appointment, cancel_token=token)
+            pain=html.escape(pain),
+            date=res, appointment=appointment, cancel_token=token)
+        set_booking_conditions(b, conditions)
         db.session.add(b)
         db.session.flush()
         upsert_patient(b)
+        stats_booking_added(b)
+        # إشعارات — في نفس الـ transaction
+        notify_booking(name, phone, date_str, appointment)
         db.session.commit()
-    except IntegrityError:
+    except IntegrityError as e:
         db.session.rollback()
+        if not is_slot_conflict(e):
+            app.logger.error(f"Booking integrity error: {e.orig}")
+            flash("حدث خطأ، يرجى المحاولة مرة أخرى.", 'error')
+            return redirect('/')
         flash("هذا الموعد محجوز بالفعل.", 'error')
         return redirect('/')
     except Exception as e:
@@ -606,10 +3080,9 @@ def submit():
         flash("حدث خطأ، يرجى المحاولة مرة أخرى.", 'error')
         return redirect('/')
 
-    # إشعارات
-    notify_booking(name, phone, date_str, appointment)
-
-
+    availability_changed(b.date, b.slot, taken=True)
+    wake_outbox()
+    wake_reminders(b.date)
     return redirect(f'/confirmation?token={token}')
 
 
@@ -649,7 +3122,7 @@ def returning_patient():
         pain        = request.form.get('pain', '').strip()
         date_str    = request.form.get('date', '').strip()
         appointment = request.form.get('appointment', '').strip()
-        conditions  = request.form.getlist('conditions')
+        conditions  = allowed_conditions(request.form.getlist('conditions'))
         patient     = PatientProfile.query.filter_by(phone=phone).first()
 
         if not patient:
@@ -658,15 +3131,17 @@ def returning_patient():
 
         errors = []
         if not pain:                        errors.append("يرجى وصف الشكوى")
+        date_ok = False
         if not date_str:                    errors.append("التاريخ مطلوب")
         else:
-            ok, res = valid_date(date_str)
-            if not ok:                      errors.append(res)
+            date_ok, res = valid_date(date_str)
+            if not date_ok:                 errors.append(res)
         if not appointment:                 errors.append("يرجى اختيار ميعاد")
-        elif date_str and appointment in booked_slots(date_str):
-                                            errors.append("هذا الموعد محجوز بالفعل")
-        elif date_str and not filter_past_slots([appointment], date_str):
-                                            errors.append("هذا الميعاد قد مضى، يرجى اختيار ميعاد آخر")
+        elif date_ok:
+            st = slot_status(res, appointment)
+            if st == 'taken':               errors.append("هذا الموعد محجوز بالفعل")
+            elif st == 'past':              errors.append("هذا الميعاد قد مضى، يرجى اختيار ميعاد آخر")
+            elif st == 'invalid':           errors.append("يرجى اختيار ميعاد")
         if errors:
             for e in errors: flash(e, 'error')
             return redirect(f'/returning?phone={phone}')
@@ -678,16 +3153,22 @@ def returning_patient():
                 age         = patient.age or 0,
                 phone       = patient.phone,
                 pain        = html.escape(pain),
-                conditions  = ', '.join(conditions) or patient.conditions or '',
-                date        = date_str,
+                date        = res,
                 appointment = appointment,
                 cancel_token= token)
+            set_booking_conditions(b, conditions or [c.name for c in patient.condition_list])
             db.session.add(b)
             db.session.flush()
             upsert_patient(b)
+            stats_booking_added(b)
+            notify_booking(patient.name, patient.phone, date_str, appointment)
             db.session.commit()
-        except IntegrityError:
+        except IntegrityError as e:
             db.session.rollback()
+            if not is_slot_conflict(e):
+                app.logger.error(f"Booking integrity error: {e.orig}")
+                flash("حدث خطأ، يرجى المحاولة مرة أخرى.", 'error')
+                return redirect(f'/returning?phone={phone}')
             flash("هذا الموعد محجوز بالفعل، يرجى اختيار وقت آخر.", 'error')
             return redirect(f'/returning?phone={phone}')
         except Exception as e:
@@ -696,12 +3177,14 @@ def returning_patient():
             flash("حدث خطأ، يرجى المحاولة مرة أخرى.", 'error')
             return redirect(f'/returning?phone={phone}')
 
-        notify_booking(patient.name, patient.phone, date_str, appointment)
+        availability_changed(b.date, b.slot, taken=True)
+        wake_outbox()
+        wake_reminders(b.date)
         return redirect(f'/confirmation?token={token}')
 
     # GET — اعرض الصفحة
     today       = egypt_today().strftime('%Y-%m-%d')
-    free        = filter_past_slots([s for s in get_all_slots() if s not in booked_slots(today)], today)
+    free        = free_slots(egypt_today())
     form        = BookingForm()
     form.appointment.choices = [(t, t) for t in free] if free else [('', 'لا توجد مواعيد')]
 
@@ -728,11 +3211,15 @@ def cancel_booking_confirm(token):
     if b.status == 'cancelled':
         flash("هذا الحجز ملغى بالفعل", 'error')
         return redirect('/')
-    b.status = 'cancelled'
-    db.session.commit()
+    old_status = b.status
+    b.status   = 'cancelled'
+    stats_status_changed(b, old_status)
     # إشعار واتساب بالإلغاء
     msg = f"❌ تم إلغاء حجزك في مركز الهادي\nالتاريخ: {b.date} — {b.appointment}\nللحجز مرة أخرى زور الموقع 💚"
-    threading.Thread(target=send_whatsapp, args=(b.phone, msg), daemon=True).start()
+    queue_notification('whatsapp', b.phone, msg)
+    db.session.commit()
+    availability_changed(b.date, b.slot, taken=False)
+    wake_outbox()
     return render_template('cancel_success.html', booking=b)
 
 
@@ -753,6 +3240,7 @@ def rate_booking(token):
             return redirect(f'/rate/{token}')
         r = BookingRating(booking_id=b.id, stars=stars, comment=comment)
         db.session.add(r)
+        stats_rating_added(stars)
         db.session.commit()
         return render_template('rate.html', booking=b, done=True)
     return render_template('rate.html', booking=b)
@@ -782,7 +3270,7 @@ def rate_page():
             # آخر حجز مؤكد لهذا الرقم
             booking = (Booking.query
                        .filter_by(phone=phone, status='confirmed')
-                       .order_by(Booking.date.desc())
+                       .order_by(Booking.date.desc(), Booking.slot.desc())
                        .first())
             if not booking:
                 error = "لم نجد حجزاً مرتبطاً بهذا الرقم"
@@ -799,6 +3287,7 @@ def rate_page():
                     r = BookingRating(booking_id=booking.id,
                                       stars=stars, comment=comment)
                     db.session.add(r)
+                    stats_rating_added(stars)
                     db.session.commit()
                     done = True
 
@@ -882,34 +3371,37 @@ def change_password():
 @app.route('/dashboard')
 @admin_required
 def dashboard():
-    today      = egypt_today().strftime('%Y-%m-%d')
-    total      = Booking.query.filter_by(status='confirmed').count()
-    today_count= Booking.query.filter_by(date=today, status='confirmed').count()
-    patients_n = PatientProfile.query.count()
-    cancelled  = Booking.query.filter_by(status='cancelled').count()
-    attended   = Booking.query.filter_by(status='attended').count()
+    today      = egypt_today()
+    week_start = today - timedelta(days=6)
+
+    # كل الأرقام من جداول الـ rollup — مش من Booking
+    by_status  = dict(db.session.query(DailyStat.status, func.sum(DailyStat.count))
+                      .group_by(DailyStat.status).all())
+    total      = by_status.get('confirmed') or 0
+    cancelled  = by_status.get('cancelled') or 0
+    attended   = by_status.get('attended')  or 0
+    ps         = db.session.get(PatientStat, 1)
+    patients_n = ps.count if ps else 0
 
     # آخر 7 أيام — حجوزات يومية
-    days_data = []
+    week = dict(db.session.query(DailyStat.date, DailyStat.count).filter(
+        DailyStat.status == 'confirmed',
+        DailyStat.date >= week_start, DailyStat.date <= today).all())
+    today_count = week.get(today, 0)
+    days_data   = []
     for i in range(6, -1, -1):
-        d    = (egypt_today() - timedelta(days=i)).strftime('%Y-%m-%d')
-        cnt  = Booking.query.filter_by(date=d, status='confirmed').count()
-        days_data.append({'date': d, 'count': cnt})
+        d = today - timedelta(days=i)
+        days_data.append({'date': d.strftime('%Y-%m-%d'), 'count': week.get(d, 0)})
 
     # توزيع الحالات
-    from sqlalchemy import func
-    conditions_raw = db.session.query(Booking.conditions).filter(
-        Booking.conditions != '', Booking.conditions != None).all()
-    cond_count = {}
-    for (c,) in conditions_raw:
-        for item in c.split(','):
-            item = item.strip()
-            if item:
-                cond_count[item] = cond_count.get(item, 0) + 1
+    cond_count = {c.name: c.count for c in
+                  ConditionStat.query.filter(ConditionStat.count > 0)
+                                     .order_by(ConditionStat.count.desc()).all()}
 
     # متوسط التقييم
-    ratings = BookingRating.query.all()
-    avg_rating = round(sum(r.stars for r in ratings) / len(ratings), 1) if ratings else 0
+    rs = db.session.get(RatingStat, 1)
+    ratings_count = rs.count if rs else 0
+    avg_rating    = round(rs.total / rs.count, 1) if ratings_count else 0
 
     # أحدث 5 حجوزات
     recent = Booking.query.filter_by(status='confirmed')\
@@ -918,14 +3410,42 @@ def dashboard():
     return render_template('dashboard.html',
         total=total, today_count=today_count,
         patients_n=patients_n, cancelled=cancelled, attended=attended,
+        pending_migrations=sorted(PENDING_MIGRATIONS.items()),
         days_data=days_data, cond_count=cond_count,
-        avg_rating=avg_rating, ratings_count=len(ratings),
+        avg_rating=avg_rating, ratings_count=ratings_count,
         recent=recent)
 
 
 # ─────────────────────────────────────────────
 #  ADMIN — BOOKINGS + CALENDAR
 # ─────────────────────────────────────────────
+def filtered_bookings(args):
+    """Booking query بفلاتر /bookings — نفسها مستخدمة في تصدير الـ CSV"""
+    search      = args.get('search', '').strip()
+    status_f    = args.get('status_f', '').strip()
+    condition_f = args.get('condition_f', '').strip()
+    time_f      = args.get('time_f', '').strip()
+    d_from      = parse_date(args.get('date_from', '').strip())
+    d_to        = parse_date(args.get('date_to', '').strip())
+
+    query = Booking.query
+    if search:
+        query = query.filter(search_filter(Booking, search, include_notes=args.get('notes') == '1'))
+    if d_from:
+        query = query.filter(Booking.date >= d_from)
+    if d_to:
+        query = query.filter(Booking.date <= d_to)
+    if status_f:
+        query = query.filter(Booking.status == status_f)
+    if condition_f:
+        query = query.filter(Booking.condition_list.any(Condition.name == condition_f))
+    if time_f == 'AM':
+        query = query.filter(Booking.slot < 12 * 60)
+    elif time_f == 'PM':
+        query = query.filter(Booking.slot >= 12 * 60)
+    return query
+
+
 @app.route('/bookings')
 @admin_required
 def bookings():
@@ -937,41 +3457,24 @@ def bookings():
     time_f      = request.args.get('time_f', '').strip()       # AM/PM slot
     sort_by     = request.args.get('sort_by', 'date_asc')      # date_asc/date_desc/name
     view        = request.args.get('view', 'table')
+    notes_f     = request.args.get('notes') == '1'             # ابحث كمان في ملاحظات الجلسات
 
-    query = Booking.query
+    query = filtered_bookings(request.args)
 
-    if search:
-        query = query.filter(db.or_(
-            Booking.name.ilike(f'%{search}%'),
-            Booking.phone.ilike(f'%{search}%')))
-    if date_from:
-        query = query.filter(Booking.date >= date_from)
-    if date_to:
-        query = query.filter(Booking.date <= date_to)
-    if status_f:
-        query = query.filter(Booking.status == status_f)
-    if condition_f:
-        query = query.filter(Booking.conditions.ilike(f'%{condition_f}%'))
-    if time_f == 'AM':
-        query = query.filter(Booking.appointment.ilike('%AM%'))
-    elif time_f == 'PM':
-        query = query.filter(Booking.appointment.ilike('%PM%'))
+    # إحصائيات سريعة للفلتر الحالي — GROUP BY بدل تحميل كل الصفوف
+    by_status = dict(query.with_entities(Booking.status, func.count())
+                          .group_by(Booking.status).all())
+    stats = {st: by_status.get(st, 0) for st in ('confirmed', 'attended', 'cancelled')}
+    total = sum(by_status.values())
 
+    by_id = (Booking.id, False, lambda b: b.id)
     if sort_by == 'date_desc':
-        query = query.order_by(Booking.date.desc(), Booking.appointment)
+        order = [(Booking.date, True, lambda b: b.date), (Booking.slot, False, lambda b: b.slot), by_id]
     elif sort_by == 'name':
-        query = query.order_by(Booking.name)
+        order = [(Booking.name, False, lambda b: b.name), by_id]
     else:
-        query = query.order_by(Booking.date, Booking.appointment)
-
-    all_bookings = query.all()
-
-    # إحصائيات سريعة للفلتر الحالي
-    stats = {
-        'confirmed': sum(1 for b in all_bookings if b.status == 'confirmed'),
-        'attended':  sum(1 for b in all_bookings if b.status == 'attended'),
-        'cancelled': sum(1 for b in all_bookings if b.status == 'cancelled'),
-    }
+        order = [(Booking.date, False, lambda b: b.date), (Booking.slot, False, lambda b: b.slot), by_id]
+    page, next_cursor = keyset_page(query, order, page_size())
 
     # بيانات Calendar
     cal_data = {}
@@ -981,17 +3484,20 @@ def bookings():
         last  = (first.replace(month=first.month % 12 + 1, day=1)
                  if first.month < 12 else first.replace(year=first.year+1, month=1, day=1))
         month_bookings = Booking.query.filter(
-            Booking.date >= first.strftime('%Y-%m-%d'),
-            Booking.date <  last.strftime('%Y-%m-%d'),
-            Booking.status.in_(['confirmed', 'attended'])).all()
+            Booking.date >= first,
+            Booking.date <  last,
+            Booking.status.in_(TAKEN_STATUSES)).order_by(Booking.date, Booking.slot).all()
         for b in month_bookings:
-            cal_data.setdefault(b.date, []).append(b)
+            cal_data.setdefault(b.date.strftime('%Y-%m-%d'), []).append(b)
 
     # الفلاتر النشطة
     active_filters = any([search, date_from, date_to, status_f, condition_f, time_f])
 
     return render_template('bookings.html',
-        bookings=all_bookings, search=search,
+        bookings=page, total=total,
+        next_url=page_url(after=next_cursor) if next_cursor else None,
+        first_url=page_url(after=None) if request.args.get('after') else None,
+        search=search, notes_f=notes_f,
         date_from=date_from, date_to=date_to,
         status_f=status_f, condition_f=condition_f,
         time_f=time_f, sort_by=sort_by,
@@ -1005,11 +3511,16 @@ def bookings():
 @limiter.limit("20 per minute")
 def delete_booking(bid):
     b = Booking.query.get_or_404(bid)
+    stats_booking_removed(b)
     # احذف التقييم والملاحظات المرتبطة أولاً قبل الحجز
     BookingRating.query.filter_by(booking_id=bid).delete()
     SessionNote.query.filter_by(booking_id=bid).delete()
+    date, slot, was_taken = b.date, b.slot, b.status in TAKEN_STATUSES
     db.session.delete(b)
     db.session.commit()
+    # حجز ملغي ممكن يكون الـ slot بتاعه اتحجز تاني — متفضّيش الـ bit
+    if was_taken:
+        availability_changed(date, slot, taken=False)
     flash("تم حذف الحجز", 'success')
     return redirect('/bookings')
 
@@ -1019,13 +3530,20 @@ def delete_booking(bid):
 @limiter.limit("30 per minute")
 def attend_booking(bid):
     b = Booking.query.get_or_404(bid)
+    if b.status == 'cancelled':
+        return redirect(request.referrer or '/bookings')
+    old_status = b.status
     if b.status == 'confirmed':
         b.status = 'attended'
         flash(f"✅ تم تأكيد حضور {b.name}", 'success')
     elif b.status == 'attended':
         b.status = 'confirmed'
         flash("↩️ تم إلغاء تأكيد الحضور", 'success')
+    stats_status_changed(b, old_status)
     db.session.commit()
+    # confirmed ↔ attended — الـ slot محجوز في الحالتين، التوافر ما اتغيرش
+    if (old_status in TAKEN_STATUSES) != (b.status in TAKEN_STATUSES):
+        availability_changed(b.date, b.slot, taken=b.status in TAKEN_STATUSES)
     return redirect(request.referrer or '/bookings')
 
 
@@ -1035,22 +3553,30 @@ def attend_booking(bid):
 @app.route('/patients')
 @admin_required
 def patients():
-    search = request.args.get('search', '').strip()
-    query  = PatientProfile.query
+    search  = request.args.get('search', '').strip()
+    notes_f = request.args.get('notes') == '1'
+    query   = PatientProfile.query
     if search:
-        query = query.filter(db.or_(
-            PatientProfile.name.ilike(f'%{search}%'),
-            PatientProfile.phone.ilike(f'%{search}%')))
-    all_patients = query.order_by(PatientProfile.last_visit.desc()).all()
-    return render_template('patients.html', patients=all_patients, search=search)
+        query = query.filter(search_filter(PatientProfile, search, include_notes=notes_f))
+    total = query.count()
+    order = [(PatientProfile.last_visit, True, lambda p: p.last_visit),
+             (PatientProfile.id, True, lambda p: p.id)]
+    page, next_cursor = keyset_page(query, order, page_size())
+    return render_template('patients.html', patients=page, total=total,
+        search=search, notes_f=notes_f,
+        next_url=page_url(after=next_cursor) if next_cursor else None,
+        first_url=page_url(after=None) if request.args.get('after') else None)
 
 
 @app.route('/patient/<int:pid>')
 @admin_required
 def patient_profile(pid):
-    p        = PatientProfile.query.get_or_404(pid)
-    history  = Booking.query.filter_by(phone=p.phone)\
-                            .order_by(Booking.date.desc()).all()
+    # 3 queries ثابتة: المريض، ملاحظاته (selectin)، الحجوزات مع تقييماتها (join)
+    p        = (PatientProfile.query.options(selectinload(PatientProfile.session_notes))
+                .get_or_404(pid))
+    history  = (Booking.query.filter_by(phone=p.phone)
+                .options(joinedload(Booking.rating))
+                .order_by(Booking.date.desc(), Booking.slot.desc()).all())
     nf       = SessionNoteForm()
     df       = DoctorNotesForm(doctor_notes=p.doctor_notes)
     return render_template('patient_profile.html',
@@ -1066,7 +3592,7 @@ def add_session_note(pid):
         note = SessionNote(
             patient_id   = p.id,
             booking_id   = request.form.get('booking_id') or None,
-            date         = request.form.get('note_date') or egypt_today().strftime('%Y-%m-%d'),
+            date         = parse_date(request.form.get('note_date')) or egypt_today(),
             appointment  = request.form.get('note_appointment', ''),
             complaint    = html.escape(nf.complaint.data or ''),
             diagnosis    = html.escape(nf.diagnosis.data or ''),
@@ -1106,7 +3632,9 @@ def delete_session_note(pid, nid):
 @admin_required
 def delete_patient(pid):
     SessionNote.query.filter_by(patient_id=pid).delete()
-    PatientProfile.query.filter_by(id=pid).delete()
+    db.session.execute(patient_conditions.delete().where(patient_conditions.c.patient_id == pid))
+    if PatientProfile.query.filter_by(id=pid).delete():
+        stats_patient_added(sign=-1)
     db.session.commit()
     flash("تم حذف ملف المريض", 'success')
     return redirect('/patients')
@@ -1119,14 +3647,20 @@ def delete_patient(pid):
 @app.route('/ratings')
 @admin_required
 def ratings():
-    all_ratings = (BookingRating.query
-                   .order_by(BookingRating.created_at.desc())
-                   .all())
-    avg = round(sum(r.stars for r in all_ratings) / len(all_ratings), 1) if all_ratings else 0
-    dist = {i: sum(1 for r in all_ratings if r.stars == i) for i in range(1, 6)}
+    # التوزيع والمتوسط من GROUP BY واحد — الكروت صفحة صفحة مع الحجز في نفس الـ query
+    dist  = dict.fromkeys(range(1, 6), 0)
+    dist.update(db.session.query(BookingRating.stars, func.count())
+                .group_by(BookingRating.stars).all())
+    total = sum(dist.values())
+    avg   = round(sum(s * n for s, n in dist.items()) / total, 1) if total else 0
+    order = [(BookingRating.created_at, True, lambda r: r.created_at),
+             (BookingRating.id,         True, lambda r: r.id)]
+    page, next_cursor = keyset_page(
+        BookingRating.query.options(joinedload(BookingRating.booking)), order, page_size())
     return render_template('ratings.html',
-                           ratings=all_ratings, avg=avg,
-                           dist=dist, total=len(all_ratings))
+                           ratings=page, avg=avg, dist=dist, total=total,
+                           next_url=page_url(after=next_cursor) if next_cursor else None,
+                           first_url=page_url(after=None) if request.args.get('after') else None)
 
 
 
@@ -1147,12 +3681,14 @@ def clinic_settings():
             s.end_hour      = int(request.form.get('end_hour', 23))    # 24h
             s.slot_duration = int(request.form.get('slot_duration', 30))
             db.session.commit()
+            invalidate_settings()
             flash('✅ تم حفظ أوقات العمل', 'success')
 
         elif action == 'days':
             days = request.form.getlist('work_days')
             s.work_days = ','.join(days) if days else ''
             db.session.commit()
+            invalidate_settings()
             flash('✅ تم حفظ أيام العمل', 'success')
 
         elif action == 'add_holiday':
@@ -1162,6 +3698,7 @@ def clinic_settings():
                 existing.add(date)
                 s.holidays = ','.join(sorted(existing))
                 db.session.commit()
+                invalidate_settings()
                 flash(f'✅ تمت إضافة إجازة {date}', 'success')
 
         elif action == 'remove_holiday':
@@ -1171,6 +3708,7 @@ def clinic_settings():
                 existing.discard(date)
                 s.holidays = ','.join(sorted(existing))
                 db.session.commit()
+                invalidate_settings()
                 flash(f'تم حذف إجازة {date}', 'success')
 
         return redirect('/settings')
@@ -1201,67 +3739,121 @@ def upload_photo():
         if ext not in ALLOWED_EXT:
             flash('صيغة غير مدعومة — يُسمح فقط بـ JPG, PNG, WEBP', 'error')
             return redirect('/upload_photo')
-        # احفظها باسم ثابت doctor-clean.<ext>
-        filename = f'doctor-clean.{ext}'
-        save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        # احذف الصورة القديمة لو بصيغة مختلفة
-        for old_ext in ALLOWED_EXT:
-            old_path = os.path.join(app.config['UPLOAD_FOLDER'], f'doctor-clean.{old_ext}')
-            if os.path.exists(old_path) and old_ext != ext:
-                os.remove(old_path)
-        f.save(save_path)
+        if Image is None:
+            flash('معالجة الصور غير متاحة على السيرفر (pip install Pillow)', 'error')
+            return redirect('/upload_photo')
+        try:
+            set_doctor_photo(f.read())
+        except ValueError as e:
+            flash(f'❌ {e}', 'error')
+            return redirect('/upload_photo')
         flash('✅ تم رفع الصورة بنجاح', 'success')
         return redirect('/upload_photo')
-    # GET — اعرض الصفحة
-    current = None
-    for ext in ALLOWED_EXT:
-        p = os.path.join(app.config['UPLOAD_FOLDER'], f'doctor-clean.{ext}')
-        if os.path.exists(p):
-            current = f'doctor-clean.{ext}'
-            break
-    return render_template('upload_photo.html', current=current)
+    return render_template('upload_photo.html', photo=doctor_photo())
+
+# ─────────────────────────────────────────────
+#  ADMIN — PROFILES
+# ─────────────────────────────────────────────
+@app.route('/profiles')
+@admin_required
+def profiles():
+    return render_template('profiles.html', profiles=recent_profiles(),
+                           sample=app.config['PROFILE_SAMPLE'])
+
+
+@app.route('/profiles/<name>')
+@admin_required
+def download_profile(name):
+    return send_from_directory(_profile_dir(), secure_filename(name),
+                               mimetype='text/plain', as_attachment=True)
+
 
 # ─────────────────────────────────────────────
-#  CSV EXPORT
+#  ADMIN — METRICS  (Prometheus scrape)
 # ─────────────────────────────────────────────
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    auth  = request.headers.get('Authorization', '')
+    if not session.get('admin_logged_in') and not (
+            token and secrets.compare_digest(auth, f"Bearer {token}")):
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    flush_metrics()
+    counters, hists, gauges, live = _merge_metrics()
+    gauges[('metrics_workers', ())] = live
+    # حالة الـ outbox من الـ DB — مشتركة بين كل الـ workers فمش بتتجمع
+    for status in ('pending', 'sending', 'failed'):
+        gauges[('notifications_queued', (('status', status),))] = 0
+    for status, n in (db.session.query(Notification.status, func.count())
+                      .filter(Notification.status.in_(('pending', 'sending', 'failed')))
+                      .group_by(Notification.status)):
+        gauges[('notifications_queued', (('status', status),))] = n
+    oldest = (db.session.query(func.min(Notification.created_at))
+              .filter(Notification.status == 'pending').scalar())
+    gauges[('notification_oldest_pending_seconds', ())] = (
+        round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0)
+    return Response(render_metrics(counters, hists, gauges),
+                    mimetype='text/plain; version=0.0.4')
+
+
+# ─────────────────────────────────────────────
+#  CSV EXPORT — streaming بذاكرة ثابتة
+# ─────────────────────────────────────────────
+app.config['EXPORT_BATCH'] = 1000   # صفوف لكل fetch من الـ DB ولكل chunk في الـ response
+
+
+def csv_response(header, rows, filename):
+    """Response بيتبعت chunk chunk — الـ BOM مرة واحدة في الأول عشان Excel يقرا العربي"""
+    def generate():
+        buf = io.StringIO()
+        w   = csv.writer(buf)
+        buf.write('\ufeff')
+        w.writerow(header)
+        for n, row in enumerate(rows, 1):
+            w.writerow(row)
+            if n % app.config['EXPORT_BATCH'] == 0:
+                yield buf.getvalue().encode('utf-8')
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue().encode('utf-8')
+    return Response(stream_with_context(generate()),
+                    mimetype='text/csv; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
 @app.route('/export/bookings')
 @admin_required
 def export_bookings():
-    output = io.StringIO()
-    w = csv.writer(output)
-    w.writerow(['#', 'الاسم', 'العمر', 'الهاتف', 'الشكوى',
-                'الحالات', 'التاريخ', 'الميعاد', 'الحالة', 'تاريخ الحجز'])
-    for i, b in enumerate(Booking.query.order_by(Booking.date).all(), 1):
-        w.writerow([i, b.name, b.age, b.phone, b.pain,
-                    b.conditions, b.date, b.appointment,
-                    b.status, b.created_at.strftime('%Y-%m-%d %H:%M') if b.created_at else ''])
-    output.seek(0)
-    bom = '\ufeff' + output.getvalue()
-    return send_file(
-        io.BytesIO(bom.encode('utf-8')),
-        mimetype='text/csv; charset=utf-8',
-        as_attachment=True,
-        download_name=f"bookings_{egypt_today()}.csv")
+    """نفس فلاتر /bookings (search/date_from/date_to/status_f/condition_f/time_f)"""
+    query = (filtered_bookings(request.args)
+             .order_by(Booking.date, Booking.slot, Booking.id)
+             .yield_per(app.config['EXPORT_BATCH']))   # server-side cursor في PostgreSQL
+    rows  = ([i, b.name, b.age, b.phone, b.pain,
+              b.conditions, b.date, b.appointment,
+              b.status, b.created_at.strftime('%Y-%m-%d %H:%M') if b.created_at else '']
+             for i, b in enumerate(query, 1))
+    return csv_response(['#', 'الاسم', 'العمر', 'الهاتف', 'الشكوى',
+                         'الحالات', 'التاريخ', 'الميعاد', 'الحالة', 'تاريخ الحجز'],
+                        rows, f"bookings_{egypt_today()}.csv")
 
 
 @app.route('/export/patients')
 @admin_required
 def export_patients():
-    output = io.StringIO()
-    w = csv.writer(output)
-    w.writerow(['#', 'الاسم', 'الهاتف', 'العمر', 'الحالات المزمنة',
-                'أول زيارة', 'آخر زيارة', 'إجمالي الزيارات', 'ملاحظات الدكتور'])
-    for i, p in enumerate(PatientProfile.query.order_by(PatientProfile.name).all(), 1):
-        w.writerow([i, p.name, p.phone, p.age, p.conditions,
-                    p.first_visit, p.last_visit, p.total_visits,
-                    (p.doctor_notes or '').replace('\n', ' ')])
-    output.seek(0)
-    bom = '\ufeff' + output.getvalue()
-    return send_file(
-        io.BytesIO(bom.encode('utf-8')),
-        mimetype='text/csv; charset=utf-8',
-        as_attachment=True,
-        download_name=f"patients_{egypt_today()}.csv")
+    query = PatientProfile.query
+    search = request.args.get('search', '').strip()
+    if search:
+        query = query.filter(search_filter(PatientProfile, search,
+                                           include_notes=request.args.get('notes') == '1'))
+    query = query.order_by(PatientProfile.name, PatientProfile.id).yield_per(app.config['EXPORT_BATCH'])
+    rows  = ([i, p.name, p.phone, p.age, p.conditions,
+              p.first_visit, p.last_visit, p.total_visits,
+              (p.doctor_notes or '').replace('\n', ' ')]
+             for i, p in enumerate(query, 1))
+    return csv_response(['#', 'الاسم', 'الهاتف', 'العمر', 'الحالات المزمنة',
+                         'أول زيارة', 'آخر زيارة', 'إجمالي الزيارات', 'ملاحظات الدكتور'],
+                        rows, f"patients_{egypt_today()}.csv")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,350 @@
+"""
+bench.py — قياس أداء مسار الحجز العام وصفحات الأدمن
+
+    python bench.py                                  # SQLite مؤقت + Flask test client
+    python bench.py --gunicorn --workers 4           # وكمان من خلال gunicorn حقيقي
+    python bench.py --db postgresql://user@/clinic   # على PostgreSQL (لازم DB فاضية)
+    python bench.py --compare bench-results/old.json
+
+النتايج بتتحفظ JSON في bench-results/ — p50/p95/p99، throughput، و queries لكل request.
+"""
+import os, sys, re, json, time, random, argparse, tempfile, subprocess, socket, threading, itertools
+import http.client, urllib.parse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ADMIN_PASSWORD = 'bench-admin'
+CSRF_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+# ─────────────────────────────────────────────
+#  ENV — لازم يتظبط قبل import app
+# ─────────────────────────────────────────────
+def bench_env(db_url, stamp_dir):
+    from werkzeug.security import generate_password_hash
+    return {
+        'DATABASE_URL':          db_url,
+        'STAMP_DIR':             stamp_dir,
+        'ADMIN_USERNAME':        'admin',
+        'ADMIN_PASSWORD':        generate_password_hash(ADMIN_PASSWORD),
+        'SESSION_COOKIE_SECURE': '0',
+        'RATELIMIT_ENABLED':     '0',
+        'NOTIFY_TRANSPORT':      'local',
+        'SECRET_KEY':            'bench',
+        'SQL_SERVER_TIMING':     '1',      # عدد الـ queries من gunicorn في header
+    }
+
+
+def free_pairs(m, days):
+    """(date, slot) فاضية في الأيام الجاية — كل submit بياخد واحدة"""
+    pairs, d = [], m.egypt_today() + timedelta(days=1)
+    for _ in range(days):
+        if m.closed_reason(d) is None:
+            pairs += [(d.strftime('%Y-%m-%d'), s) for s in m.free_slots(d)]
+        d += timedelta(days=1)
+    return pairs
+
+
+# ─────────────────────────────────────────────
+#  CLIENTS — نفس الـ interface للـ test client و HTTP
+# ─────────────────────────────────────────────
+class TestClient:
+    """Flask test client في نفس الـ process — بيعد الـ queries كمان"""
+    def __init__(self, m):
+        self.c = m.app.test_client()
+
+    def request(self, method, path, data=None):
+        r = self.c.open(path, method=method, data=data)
+        return r.status_code, r.get_data(as_text=True), r.headers.get('Location', '')
+
+
+class HTTPClient:
+    """connection keep-alive واحدة لكل thread + session cookie"""
+    def __init__(self, host, port):
+        self.host, self.port, self.cookies, self.conn = host, port, {}, None
+        self.queries = 0
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{k}={v}" for k, v in self.cookies.items())
+        if data is not None:
+            body = urllib.parse.urlencode(data, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                r = self.conn.getresponse()
+                text = r.read().decode('utf-8', 'replace')
+                break
+            except (http.client.HTTPException, ConnectionError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        found = QUERIES_RE.search(r.headers.get('Server-Timing', ''))
+        self.queries = int(found.group(1)) if found else 0
+        for h in r.headers.get_all('Set-Cookie') or []:
+            k, _, v = h.split(';', 1)[0].partition('=')
+            self.cookies[k.strip()] = v
+        if r.will_close:
+            self.conn.close()
+            self.conn = None
+        return r.status, text, r.headers.get('Location', '')
+
+
+def csrf(client, path='/'):
+    _, page, _ = client.request('GET', path)
+    found = CSRF_RE.search(page)
+    return found.group(1) if found else ''
+
+
+# ─────────────────────────────────────────────
+#  SCENARIOS
+# ─────────────────────────────────────────────
+def scenarios(ctx):
+    """(name, admin?, fn(client, i)) — كل fn بترجع status code"""
+    dates, phones, pairs = ctx['dates'], ctx['phones'], ctx['pairs']
+    lock, used = ctx['lock'], ctx['used']
+
+    def take_pair():
+        with lock:
+            k = next(used)
+        return pairs[k % len(pairs)]
+
+    def get(path):
+        return lambda c, i: c.request('GET', path(i))[0]
+
+    def booked(status, location):
+        # الحجز الناجح بيحوّل على /confirmation — أي redirect تاني يبقى رفض (محجوز/validation)
+        return 409 if status == 302 and '/confirmation' not in location else status
+
+    def submit(c, i):
+        d, slot = take_pair()
+        status, _, location = c.request('POST', '/submit', {
+            'csrf_token': c.token, 'name': 'Bench Patient', 'age': '33', 'pain': 'neck',
+            'phone': f"016{random.randrange(10**8):08d}", 'date': d, 'appointment': slot})
+        return booked(status, location)
+
+    def returning(c, i):
+        d, slot = take_pair()
+        status, _, location = c.request('POST', '/returning', {
+            'csrf_token': c.token, 'phone': phones[i % len(phones)], 'pain': 'knee',
+            'date': d, 'appointment': slot})
+        return booked(status, location)
+
+    return [
+        ('index',            False, get(lambda i: '/')),
+        ('available_slots',  False, get(lambda i: f"/available_slots?date={dates[i % len(dates)]}")),
+        ('available_range',  False, get(lambda i: '/available_slots/range')),
+        ('submit',           False, submit),
+        ('returning_get',    False, get(lambda i: f"/returning?phone={phones[i % len(phones)]}")),
+        ('returning_post',   False, returning),
+        ('dashboard',        True,  get(lambda i: '/dashboard')),
+        ('bookings',         True,  get(lambda i: '/bookings')),
+        ('bookings_search',  True,  get(lambda i: f"/bookings?search={phones[i % len(phones)][-4:]}")),
+        ('bookings_calendar', True, get(lambda i: '/bookings?view=calendar')),
+        ('patients',         True,  get(lambda i: '/patients')),
+        ('ratings',          True,  get(lambda i: '/ratings')),
+    ]
+
+
+def login(client):
+    token = csrf(client, '/login')
+    client.request('POST', '/login', {'csrf_token': token, 'username': 'admin',
+                                      'password': ADMIN_PASSWORD})
+
+
+def pct(sorted_vals, p):
+    if not sorted_vals:
+        return None
+    return round(sorted_vals[min(len(sorted_vals) - 1, int(p * len(sorted_vals)))] * 1000, 2)
+
+
+def summarize(latencies, statuses, wall, queries=None):
+    lat = sorted(latencies)
+    out = {'requests': len(lat), 'p50_ms': pct(lat, .50), 'p95_ms': pct(lat, .95),
+           'p99_ms': pct(lat, .99), 'mean_ms': round(sum(lat) / len(lat) * 1000, 2) if lat else None,
+           'rps': round(len(lat) / wall, 1) if wall else None,
+           'errors': sum(1 for s in statuses if s >= 500),
+           'status': {str(s): statuses.count(s) for s in sorted(set(statuses))}}
+    if queries is not None:
+        out['queries_per_request'] = round(sum(queries) / len(queries), 2) if queries else None
+        out['max_queries'] = max(queries) if queries else None
+    return out
+
+
+def run_testclient(m, ctx, n):
+    """كل scenario n مرة على thread واحد — latency + queries لكل request"""
+    public, admin = TestClient(m), TestClient(m)
+    public.token = csrf(public)
+    login(admin)
+    admin.token = ''
+    results = {}
+    for name, is_admin, fn in scenarios(ctx):
+        c = admin if is_admin else public
+        fn(c, 0)                       # warm-up
+        lat, st, qs = [], [], []
+        t0 = time.perf_counter()
+        for i in range(n):
+            with m.query_log() as log:
+                s = time.perf_counter()
+                st.append(fn(c, i))
+                lat.append(time.perf_counter() - s)
+            qs.append(log.count)
+        results[name] = summarize(lat, st, time.perf_counter() - t0, qs)
+        print(f"  {name:<18} p50 {results[name]['p50_ms']:>8} ms  p95 {results[name]['p95_ms']:>8} ms  "
+              f"q/req {results[name]['queries_per_request']}")
+    return results
+
+
+def run_http(port, ctx, n, concurrency):
+    """كل scenario n request موزعين على concurrency clients"""
+    results = {}
+    local   = threading.local()
+
+    def client(is_admin):
+        key = 'admin' if is_admin else 'public'
+        c = getattr(local, key, None)
+        if c is None:
+            c = HTTPClient('127.0.0.1', port)
+            if is_admin:
+                login(c)
+                c.token = ''
+            else:
+                c.token = csrf(c)
+            setattr(local, key, c)
+        return c
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for name, is_admin, fn in scenarios(ctx):
+            def one(i):
+                c = client(is_admin)
+                s = time.perf_counter()
+                status = fn(c, i)
+                return time.perf_counter() - s, status, c.queries
+            list(pool.map(one, range(concurrency)))   # warm-up + login لكل thread
+            t0   = time.perf_counter()
+            done = list(pool.map(one, range(n)))
+            wall = time.perf_counter() - t0
+            results[name] = summarize([d for d, _, _ in done], [s for _, s, _ in done], wall,
+                                      [q for _, _, q in done])
+            print(f"  {name:<18} p50 {results[name]['p50_ms']:>8} ms  p95 {results[name]['p95_ms']:>8} ms  "
+                  f"{results[name]['rps']} req/s  q/req {results[name]['queries_per_request']}")
+    return results
+
+
+def start_gunicorn(env, workers, threads):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--workers', str(workers),
+         '--threads', str(threads), '--worker-class', 'gthread', '--bind', f'127.0.0.1:{port}',
+         '--log-level', 'warning'],
+        cwd=ROOT, env={**os.environ, **env, 'AUTO_MIGRATE': '0'})
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return proc, port
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup')
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(old_path, new):
+    """فرق p95 و queries/request بين نتيجتين"""
+    old = json.load(open(old_path))
+    print(f"\nvs {old_path} ({old['meta'].get('git')})")
+    for mode, res in new['results'].items():
+        for name, r in res.items():
+            o = old['results'].get(mode, {}).get(name)
+            if not o or not o.get('p95_ms') or not r.get('p95_ms'):
+                continue
+            delta = (r['p95_ms'] - o['p95_ms']) / o['p95_ms'] * 100
+            q = ''
+            if 'queries_per_request' in r and 'queries_per_request' in o:
+                q = f"  q/req {o['queries_per_request']} → {r['queries_per_request']}"
+            print(f"  {mode:<10} {name:<18} p95 {o['p95_ms']:>8} → {r['p95_ms']:>8} ms ({delta:+.0f}%){q}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--db', help='DATABASE_URL (الافتراضي: SQLite مؤقت)')
+    ap.add_argument('--bookings',    type=int, default=50_000)
+    ap.add_argument('--patients',    type=int, default=5_000)
+    ap.add_argument('--days-ahead',  type=int, default=60)
+    ap.add_argument('--requests',    type=int, default=200, help='requests لكل scenario')
+    ap.add_argument('--seed',        type=int, default=1)
+    ap.add_argument('--gunicorn',    action='store_true')
+    ap.add_argument('--workers',     type=int, default=4)
+    ap.add_argument('--threads',     type=int, default=2)
+    ap.add_argument('--concurrency', type=int, default=8)
+    ap.add_argument('--out',         default=os.path.join(ROOT, 'bench-results'))
+    ap.add_argument('--compare')
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='clinic-bench-')
+    env = bench_env(args.db or f"sqlite:///{tmp}/bench.db", os.path.join(tmp, 'stamps'))
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    import app as m
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    with m.app.app_context():
+        t0 = time.perf_counter()
+        counts = m.seed_data(args.bookings, args.patients, args.days_ahead, args.seed)
+        print(f"seeded {counts} in {time.perf_counter() - t0:.1f}s")
+        ctx = {'pairs':  free_pairs(m, args.days_ahead),
+               'dates':  sorted({d for d, _ in free_pairs(m, 14)}),
+               'phones': [p for (p,) in m.db.session.query(m.PatientProfile.phone).limit(500)],
+               'lock':   threading.Lock(),
+               'used':   itertools.count()}
+        dialect = m.db.engine.dialect.name
+    rng.shuffle(ctx['pairs'])
+
+    report = {'meta': {'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+                       'git': git_rev(), 'python': sys.version.split()[0], 'db': dialect,
+                       'seeded': counts, 'args': vars(args)},
+              'results': {}}
+    print('test client:')
+    report['results']['testclient'] = run_testclient(m, ctx, args.requests)
+
+    if args.gunicorn:
+        print(f"gunicorn ({args.workers} workers × {args.threads} threads, {args.concurrency} clients):")
+        proc, port = start_gunicorn(env, args.workers, args.threads)
+        try:
+            report['results']['gunicorn'] = run_http(port, ctx, args.requests, args.concurrency)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.now():%Y%m%d-%H%M%S}-{report['meta']['git'] or 'local'}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"\nresults → {path}")
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == '__main__':
+    main()
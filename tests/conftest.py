@@ -0,0 +1,39 @@
+"""إعداد مشترك للـ tests — DB و STAMP_DIR مؤقتين لازم يتظبطوا قبل import app"""
+import os, sys, tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix='clinic-tests-')
+os.environ.update({
+    'DATABASE_URL':          f"sqlite:///{os.path.join(_tmp, 'test.db')}",
+    'STAMP_DIR':             os.path.join(_tmp, 'stamps'),
+    'NOTIFY_TRANSPORT':      'local',   # من غير Twilio / CallMeBot
+    'SESSION_COOKIE_SECURE': '0',       # test client على http
+    'RATELIMIT_ENABLED':     '0',
+    'ASSETS_AUTO_BUILD':     '0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as clinic   # noqa: E402
+
+clinic.app.config['WTF_CSRF_ENABLED'] = False
+clinic.limiter.enabled = False
+
+
+@pytest.fixture(scope='session')
+def seeded():
+    """داتا بحجم صغير بس فيها أكتر من صفحة في كل جدول — مرة واحدة للـ session كلها"""
+    with clinic.app.app_context():
+        return clinic.seed_data(bookings=3000, patients=400, days_ahead=30, seed=1, batch=1000)
+
+
+@pytest.fixture
+def client():
+    return clinic.app.test_client()
+
+
+@pytest.fixture
+def admin_client(client):
+    with client.session_transaction() as s:
+        s['admin_logged_in'] = True
+    return client
@@ -0,0 +1,85 @@
+"""N حجز في نفس اللحظة على نفس الميعاد — واحد بس يكسب (uq_booking_active_slot)"""
+import threading
+from datetime import timedelta
+
+from conftest import clinic
+
+N = 20
+
+
+def _free_day():
+    """يوم شغل بعد الأيام اللي الـ seed ملاها"""
+    with clinic.app.app_context():
+        d = clinic.egypt_today() + timedelta(days=45)
+        while not clinic.valid_date(d.strftime('%Y-%m-%d'))[0]:
+            d += timedelta(days=1)
+        return d, clinic.free_slots(d)[0]
+
+
+def test_parallel_submits_book_slot_once(seeded):
+    d, slot = _free_day()
+    barrier = threading.Barrier(N)
+    results = [None] * N
+
+    def submit(i):
+        c = clinic.app.test_client()
+        barrier.wait()
+        resp = c.post('/submit', data={
+            'name': 'Race Patient', 'phone': f'0199{i:07d}', 'age': '30', 'pain': 'back',
+            'date': d.strftime('%Y-%m-%d'), 'appointment': slot})
+        results[i] = (resp.status_code, resp.headers.get('Location', ''))
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(N)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert all(status == 302 for status, _ in results), results
+    winners = [loc for _, loc in results if '/confirmation' in loc]
+    assert len(winners) == 1, results
+    with clinic.app.app_context():
+        active = clinic.Booking.query.filter(
+            clinic.Booking.date == d,
+            clinic.Booking.slot == clinic.slot_to_minutes(slot),
+            clinic.Booking.status.in_(clinic.TAKEN_STATUSES)).count()
+    assert active == 1
+    with clinic.app.app_context():
+        assert clinic.slot_status(d, slot) == 'taken'
+
+
+def test_parallel_first_bookings_same_phone(seeded):
+    """أول حجز لنفس الرقم من أكتر من request — كلهم يتحجزوا وملف مريض واحد"""
+    with clinic.app.app_context():
+        d = clinic.egypt_today() + timedelta(days=50)
+        while not clinic.valid_date(d.strftime('%Y-%m-%d'))[0]:
+            d += timedelta(days=1)
+        slots = clinic.free_slots(d)[:8]
+    phone   = '01980000000'
+    barrier = threading.Barrier(len(slots))
+    results = [None] * len(slots)
+
+    def submit(i):
+        c = clinic.app.test_client()
+        barrier.wait()
+        resp = c.post('/submit', data={
+            'name': 'Same Phone', 'phone': phone, 'age': '40', 'pain': 'knee',
+            'date': d.strftime('%Y-%m-%d'), 'appointment': slots[i]})
+        results[i] = resp.headers.get('Location', '')
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(slots))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # اللي يوصل بعد ما أول ملف يتعمل commit بيتحوّل لصفحة المرضى القدامى — ده مش خطأ
+    booked = [loc for loc in results if '/confirmation' in loc]
+    assert booked, results
+    assert all(loc in booked or 'redirect=blocked' in loc for loc in results), results
+    with clinic.app.app_context():
+        profiles = clinic.PatientProfile.query.filter_by(phone=phone).all()
+        assert len(profiles) == 1
+        assert profiles[0].total_visits == len(booked)
+        # الـ savepoint اللي فشل ما يزودش عدد المرضى في الداشبورد
+        assert clinic.db.session.get(clinic.PatientStat, 1).count == clinic.PatientProfile.query.count()
@@ -0,0 +1,47 @@
+"""migration 6 مع حجوزات مكررة — تتأجل بصوت عالي (flask migrate + الداشبورد) وتتنفذ بعد التصليح"""
+import secrets
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from conftest import clinic
+
+
+def _book(d, appointment):
+    b = clinic.Booking(name='Dup Slot', age=30, phone='01970000000', pain='back',
+                       date=d, appointment=appointment, cancel_token=secrets.token_urlsafe(32))
+    clinic.db.session.add(b)
+    return b
+
+
+def test_duplicate_slots_defer_unique_index(seeded, admin_client):
+    runner = clinic.app.test_cli_runner()
+    with clinic.app.app_context():
+        clinic.db.session.execute(text('DROP INDEX uq_booking_active_slot'))
+        clinic.SchemaMigration.query.filter_by(version=6).delete()
+        d = clinic.egypt_today() + timedelta(days=200)
+        _book(d, '5:00 PM')
+        extra = _book(d, '5:00 PM')
+        clinic.db.session.commit()
+        extra_id = extra.id
+
+    try:
+        result = runner.invoke(args=['migrate'])
+        assert result.exit_code != 0
+        assert f"{d} 5:00 PM (x2)" in result.output
+        assert 6 in clinic.PENDING_MIGRATIONS
+
+        html = admin_client.get('/dashboard').get_data(as_text=True)
+        assert 'migration-banner' in html and f"{d} 5:00 PM" in html
+    finally:
+        with clinic.app.app_context():
+            clinic.db.session.delete(clinic.db.session.get(clinic.Booking, extra_id))
+            clinic.db.session.commit()
+
+    result = runner.invoke(args=['migrate'])
+    assert result.exit_code == 0, result.output
+    assert not clinic.PENDING_MIGRATIONS
+    assert 'migration-banner' not in admin_client.get('/dashboard').get_data(as_text=True)
+    with clinic.app.app_context():
+        names = {ix['name'] for ix in clinic.db.inspect(clinic.db.engine).get_indexes('booking')}
+        assert 'uq_booking_active_slot' in names
@@ -0,0 +1,23 @@
+"""كل صفحة أدمن لازم تفضل جوه QUERY_BUDGETS — أي N+1 جديد يوقع الـ test"""
+import pytest
+
+from conftest import clinic
+
+
+@pytest.mark.parametrize('path', list(clinic.QUERY_BUDGETS))
+def test_admin_page_within_query_budget(seeded, admin_client, path):
+    with clinic.app.app_context():
+        pid = clinic.db.session.query(clinic.PatientProfile.id).order_by(clinic.PatientProfile.id).limit(1).scalar()
+    url = path.format(pid=pid)
+    with clinic.assert_max_queries(clinic.QUERY_BUDGETS[path]):
+        resp = admin_client.get(url)
+    assert resp.status_code == 200, url
+
+
+def test_next_page_within_query_budget(seeded, admin_client):
+    """الصفحة التانية (keyset cursor) بنفس الميزانية"""
+    html = admin_client.get('/bookings').get_data(as_text=True)
+    start = html.index('after=')
+    url = '/bookings?' + html[start:html.index('"', start)].replace('&amp;', '&')
+    with clinic.assert_max_queries(clinic.QUERY_BUDGETS['/bookings']):
+        assert admin_client.get(url).status_code == 200